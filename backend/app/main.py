@@ -1,5 +1,7 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -7,7 +9,22 @@ from dotenv import load_dotenv
 ENV_PATH = Path(__file__).resolve().parents[1] / ".env" 
 load_dotenv(dotenv_path=ENV_PATH)
 
-app = FastAPI(title="DIP Image Background Removal with AI APIs")
+from .services.http_client_service import startup_clients, shutdown_clients, pool_stats
+from .services.executor_service import startup_executor, shutdown_executor, pool_stats as executor_stats
+from .services.job_service import jobs
+from .services.upstream_limiter_service import limiter_stats
+from .services.metrics_service import REGISTRY, CONTENT_TYPE, Gauge, MetricsMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_clients()
+    await startup_executor()
+    yield
+    await jobs.shutdown()
+    await shutdown_executor()
+    await shutdown_clients()
+
+app = FastAPI(title="DIP Image Background Removal with AI APIs", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -19,6 +36,23 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+def _limiter_gauge(field: str):
+    return lambda: {(name,): stats[field] for name, stats in limiter_stats().items()}
+
+# Queue depths and in-flight counts are read when /metrics is scraped.
+for _name, _field, _help in (
+    ("upstream_concurrency_limit", "limit", "Current adaptive concurrency limit per upstream."),
+    ("upstream_in_flight", "in_flight", "Upstream calls in flight."),
+    ("upstream_queued_interactive", "queued_interactive", "Interactive calls waiting for an upstream slot."),
+    ("upstream_queued_batch", "queued_batch", "Batch calls waiting for an upstream slot."),
+):
+    REGISTRY.register(Gauge(_name, _help, ("upstream",), fn=_limiter_gauge(_field)))
+REGISTRY.register(Gauge("cpu_batch_waiting", "Batch CPU tasks waiting for a pool slot.", fn=lambda: executor_stats()["batch_waiting"]))
+REGISTRY.register(Gauge("cpu_batch_slots_free", "Free batch submission slots on the CPU pool.", fn=lambda: executor_stats()["batch_slots_free"]))
+REGISTRY.register(Gauge("jobs_queued", "Background jobs waiting for a worker.", fn=lambda: jobs.stats()["queued"]))
+REGISTRY.register(Gauge("jobs_running", "Background jobs being processed.", fn=lambda: jobs.stats()["running"]))
 
 @app.get("/")
 def root():
@@ -28,6 +62,14 @@ def root():
 def health():
     return {"status": "up"}
 
+@app.get("/health/pools")
+def health_pools():
+    return {**pool_stats(), "cpu": executor_stats(), "limiters": limiter_stats()}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/version")
 def version():
     return {"version": "0.1.0"}
@@ -37,9 +79,13 @@ from .routes import (
     remove_bg_routes,
     text2image_routes,
     image_crop_routes,
+    job_routes,
+    pipeline_routes,
 )
 
 app.include_router(image_io_routes.router)
 app.include_router(remove_bg_routes.router)
 app.include_router(text2image_routes.router)
 app.include_router(image_crop_routes.router)
+app.include_router(job_routes.router)
+app.include_router(pipeline_routes.router)
\ No newline at end of file
@@ -1,17 +1,26 @@
+import asyncio
 import json
-import zipfile
-from io import BytesIO
-from typing import Optional, List, Dict, Tuple
+from pathlib import Path
+from typing import Callable, Optional, List, Dict, Sequence, Tuple
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Form
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from ..services.image_crop_service import ImageCropService
+from ..services.executor_service import run_cpu
+from ..services.job_service import jobs, accepted_response
 from ..services.image_io_service import (
     save_step_png,
     load_step_items,
     allowed_step_regex,
     new_batch_id,
+    zip_streaming_response,
+    lineage,
+    load_source,
+    group_duplicates,
+    Source,
+    UploadSpool,
+    ITEM_WINDOW,
 )
 
 router = APIRouter(prefix="/crop", tags=["Image Crop"])
@@ -22,7 +31,7 @@ STEP_PATTERN = allowed_step_regex()
 async def crop_custom(
     file: Optional[UploadFile] = File(None),
     files: Optional[List[UploadFile]] = File(None),
-    preset: str = Query(..., description="instagram | shopee | amazon"),
+    preset: str = Query(..., description="instagram | shopee | amazon, a comma-separated list, or 'all'"),
     x: Optional[int] = Form(None),
     y: Optional[int] = Form(None),
     width: Optional[int] = Form(None),
@@ -32,7 +41,9 @@ async def crop_custom(
     source_step: str = Form("text2image", pattern=STEP_PATTERN),
     filenames: Optional[str] = Form(None),
     as_zip: int = Query(0),
+    background: int = Query(0, description="1 = return a job id immediately and process in the background"),
 ):
+    spool = UploadSpool()
     try:
         single_box = (
             {"x": x, "y": y, "width": width, "height": height}
@@ -40,31 +51,64 @@ async def crop_custom(
             else None
         )
         boxes_map = _parse_boxes_json(boxes)
+        try:
+            presets = ImageCropService.resolve_presets(preset)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         resolved_batch, payloads = await _collect_sources(
             primary_file=file,
             files=files,
             batch_id=batch_id,
             source_step=source_step,
             filenames_raw=filenames,
+            spool=spool,
         )
         target_batch = resolved_batch or batch_id or new_batch_id()
-        results, success_payloads = _run_crop_pipeline(
+        origin_step = None if (file or files) else source_step
+        if background:
+            job = jobs.submit(
+                "crop",
+                target_batch,
+                "crop",
+                [name for name, _ in payloads for _ in presets],
+                spool.hand_off(
+                    lambda job: _run_crop_pipeline(
+                        payloads,
+                        presets=presets,
+                        boxes_map=boxes_map,
+                        single_box=single_box,
+                        batch_id=target_batch,
+                        origin_step=origin_step,
+                        on_item=job.finish_item,
+                    )
+                ),
+            )
+            return JSONResponse(status_code=202, content=accepted_response(job))
+        results, success_payloads = await _run_crop_pipeline(
             payloads,
-            preset=preset,
+            presets=presets,
             boxes_map=boxes_map,
             single_box=single_box,
             batch_id=target_batch,
+            origin_step=origin_step,
         )
         successes = [item for item in results if item["ok"]]
         if not successes:
             raise HTTPException(status_code=400, detail="Cropping failed for all images.")
         if as_zip and success_payloads:
             return _zip_response(target_batch, success_payloads)
-        return {"batch_id": target_batch, "items": results}
+        return {
+            "batch_id": target_batch,
+            "items": results,
+            # Every skipped file contributes one result per preset.
+            "duplicates_skipped": sum(1 for item in results if item.get("duplicate_of")) // len(presets),
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Cropping failed: {str(e)}")
+    finally:
+        spool.close()
 
 def _parse_boxes_json(raw: Optional[str]) -> Dict[str, Dict[str, int]]:
     if not raw:
@@ -97,27 +141,25 @@ async def _collect_sources(
     batch_id: Optional[str],
     source_step: str,
     filenames_raw: Optional[str],
-) -> tuple[Optional[str], List[tuple[str, bytes]]]:
+    spool: UploadSpool,
+) -> tuple[Optional[str], List[tuple[str, Source]]]:
     uploads: List[UploadFile] = []
     if primary_file:
         uploads.append(primary_file)
     if files:
         uploads.extend(files)
-    payloads: List[tuple[str, bytes]] = []
+    payloads: List[tuple[str, Source]] = []
     if uploads:
         for f in uploads:
-            if f.content_type not in ("image/png", "application/octet-stream"):
-                raise HTTPException(status_code=400, detail="Please upload PNG files for cropping.")
-            data = await f.read()
-            if not data:
-                raise HTTPException(status_code=400, detail=f"Uploaded file '{f.filename}' is empty.")
-            payloads.append((f.filename or "image.png", data))
+            if f.content_type not in ("image/png", "image/jpeg", "image/webp", "application/octet-stream"):
+                raise HTTPException(status_code=400, detail="Please upload PNG, JPEG or WebP files for cropping.")
+            payloads.append((f.filename or "image.png", await spool.add(f)))
         return batch_id, payloads
     if not batch_id:
         raise HTTPException(status_code=400, detail="Provide uploads or a batch reference to crop.")
     names = _parse_filenames(filenames_raw)
-    stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=True)
-    payloads.extend((item["filename"], item["bytes"]) for item in stored)
+    stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=False)
+    payloads.extend((item["filename"], Path(item["path"])) for item in stored)
     return batch_id, payloads
 
 def _parse_filenames(raw: Optional[str]) -> Optional[List[str]]:
@@ -131,42 +173,131 @@ def _parse_filenames(raw: Optional[str]) -> Optional[List[str]]:
         raise HTTPException(status_code=400, detail="'filenames' must be a JSON list of strings.")
     return data
 
-def _run_crop_pipeline(
-    payloads: List[tuple[str, bytes]],
+async def _run_crop_pipeline(
+    payloads: List[tuple[str, Source]],
     *,
-    preset: str,
+    presets: List[str],
     boxes_map: Dict[str, Dict[str, int]],
     single_box: Optional[Dict[str, int]],
     batch_id: str,
-) -> tuple[List[dict], List[Tuple[str, bytes]]]:
-    results: List[dict] = []
-    successes: List[Tuple[str, bytes]] = []
-    for filename, content in payloads:
-        try:
-            box = boxes_map.get(filename) or single_box
-            out_name, out_png = ImageCropService.process_one_png(content, filename, preset, box)
-            saved_path = save_step_png(batch_id, "crop", out_name, out_png)
-            successes.append((out_name, out_png))
-            results.append(
-                {
-                    "ok": True,
-                    "filename": filename,
-                    "stored_filename": out_name,
-                    "saved_path": saved_path,
-                }
+    origin_step: Optional[str] = None,
+    on_item: Optional[Callable[[int, dict], None]] = None,
+) -> tuple[List[dict], List[Tuple[str, Path]]]:
+    """
+    Results are flat, one per (file, preset), in file-major order. Identical
+    files cropped with the same box are rendered once and saved under each
+    filename; the copies' results carry "duplicate_of".
+    """
+    window = asyncio.Semaphore(ITEM_WINDOW)
+    boxes = [boxes_map.get(filename) or single_box for filename, _ in payloads]
+    per_file: List[List[tuple[dict, Optional[Tuple[str, Path]]]]] = [[] for _ in payloads]
+
+    async def run_group(indices: List[int]):
+        first_name, content = payloads[indices[0]]
+        async with window:
+            outcomes = await _crop_one(
+                first_name,
+                content,
+                presets=presets,
+                box=boxes[indices[0]],
+                batch_id=batch_id,
+                origin_step=origin_step,
+                interactive=len(payloads) == 1,
+                copies=[payloads[idx][0] for idx in indices[1:]],
             )
-        except Exception as e:
-            results.append({"ok": False, "filename": filename, "error": str(e)})
+        for position, idx in enumerate(indices):
+            per_file[idx] = outcomes[position * len(presets):(position + 1) * len(presets)]
+            if on_item:
+                for k, (result, _) in enumerate(per_file[idx]):
+                    on_item(idx * len(presets) + k, result)
+
+    groups = await group_duplicates(
+        [content for _, content in payloads],
+        [tuple(sorted(box.items())) if box else None for box in boxes],
+    )
+    await asyncio.gather(*(run_group(indices) for indices in groups))
+    outcomes = [outcome for file_outcomes in per_file for outcome in file_outcomes]
+    results = [result for result, _ in outcomes]
+    successes = [payload for _, payload in outcomes if payload]
     return results, successes
 
-def _zip_response(batch_id: str, payloads: List[Tuple[str, bytes]]) -> StreamingResponse:
-    buf = BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for name, content in payloads:
-            zf.writestr(name, content)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": f'attachment; filename="{batch_id}_crop.zip"'},
+async def _crop_one(
+    filename: str,
+    content: Source,
+    *,
+    presets: List[str],
+    box: Optional[Dict[str, int]],
+    batch_id: str,
+    origin_step: Optional[str] = None,
+    interactive: bool = False,
+    copies: Sequence[str] = (),
+) -> List[tuple[dict, Optional[Tuple[str, Path]]]]:
+    """
+    Render `content` once per preset and save it under `filename` and every
+    name in `copies` (identical inputs). Outcomes are flat, one per (name,
+    preset) in that order; the copies' results carry "duplicate_of".
+    """
+    error: Optional[Exception] = None
+    try:
+        rendered = await _render_crops(content, presets=presets, box=box, interactive=interactive)
+    except Exception as e:
+        rendered, error = None, e
+    outcomes = []
+    for position, name in enumerate((filename, *copies)):
+        if rendered is None:
+            saved = _failed_crops(name, presets, error)
+        else:
+            saved = _save_crops(name, rendered, batch_id=batch_id, origin_step=origin_step)
+        if position:
+            for result, _ in saved:
+                result["duplicate_of"] = filename
+        outcomes.extend(saved)
+    return outcomes
+
+async def _render_crops(
+    content: Source,
+    *,
+    presets: List[str],
+    box: Optional[Dict[str, int]],
+    interactive: bool = False,
+) -> List[tuple[str, bytes]]:
+    rendered = await run_cpu(
+        ImageCropService.process_many_png,
+        await asyncio.to_thread(load_source, content),
+        "",
+        presets,
+        box,
+        interactive=interactive,
     )
+    return [(preset, out_png) for preset, _, out_png in rendered]
+
+def _failed_crops(filename: str, presets: List[str], error: Exception) -> List[tuple[dict, None]]:
+    return [({"ok": False, "filename": filename, "preset": p, "error": str(error)}, None) for p in presets]
+
+def _save_crops(
+    filename: str,
+    rendered: List[tuple[str, bytes]],
+    *,
+    batch_id: str,
+    origin_step: Optional[str] = None,
+) -> List[tuple[dict, Optional[Tuple[str, Path]]]]:
+    outcomes = []
+    for preset, out_png in rendered:
+        out_name = ImageCropService.output_name(preset, filename)
+        try:
+            saved_path = save_step_png(batch_id, "crop", out_name, out_png, source=lineage(origin_step, filename))
+        except Exception as e:
+            outcomes.append(({"ok": False, "filename": filename, "preset": preset, "error": str(e)}, None))
+            continue
+        result = {
+            "ok": True,
+            "filename": filename,
+            "preset": preset,
+            "stored_filename": out_name,
+            "saved_path": saved_path,
+        }
+        outcomes.append((result, (out_name, Path(saved_path))))
+    return outcomes
+
+def _zip_response(batch_id: str, payloads: List[Tuple[str, Path]]) -> StreamingResponse:
+    return zip_streaming_response(payloads, f"{batch_id}_crop.zip")
@@ -1,20 +1,21 @@
 # image_io_routes
 from typing import List, Optional
-import io
-import zipfile
 from pathlib import Path
 
 from fastapi import APIRouter, Query, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from ..services.image_io_service import (
     new_batch_id,
-    list_step_paths,
+    list_step_items,
+    count_step_items,
     detect_latest_step,
     zip_paths_for_batch_step,
+    zip_streaming_response,
     save_original_uploads,
     allowed_step_regex,
+    step_cache_stats,
+    UploadSpool,
 )
 
 router = APIRouter(prefix="/io", tags=["Image IO"])
@@ -28,9 +29,26 @@ async def io_batches_new():
     return {"batch_id": new_batch_id()}
 
 @router.get("/batches/{batch_id}/list")
-async def io_batches_list(batch_id: str, step: str = Query(..., pattern=STEP_PATTERN)):
-    files = [str(p) for p in list_step_paths(batch_id, step)]
-    return {"batch_id": batch_id, "step": step, "files": files}
+async def io_batches_list(
+    batch_id: str,
+    step: str = Query(..., pattern=STEP_PATTERN),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
+    items = list_step_items(batch_id, step, offset=offset, limit=limit)
+    return {
+        "batch_id": batch_id,
+        "step": step,
+        "total": count_step_items(batch_id, step),
+        "offset": offset,
+        "limit": limit,
+        "files": [item["path"] for item in items],
+        "items": items,
+    }
+
+@router.get("/cache")
+async def io_cache_stats():
+    return step_cache_stats()
 
 @router.get("/batches/{batch_id}/latest-step")
 async def io_batches_latest_step(batch_id: str):
@@ -48,14 +66,8 @@ async def io_export_zip_get(batch_id: str = Query(...), step: Optional[str] = Qu
 async def io_export_zip_post(req: ZipFromPathsReq):
     if not req.paths:
         raise HTTPException(status_code=400, detail="paths cannot be empty")
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for s in req.paths:
-            p = Path(s)
-            if p.exists() and p.suffix.lower() == ".png":
-                z.write(p, arcname=p.name)
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="application/zip", headers={"Content-Disposition": "attachment; filename=export.zip"})
+    paths = [p for p in map(Path, req.paths) if p.exists() and p.suffix.lower() == ".png"]
+    return zip_streaming_response(((p.name, p) for p in paths), "export.zip")
 
 @router.post("/uploads")
 async def io_upload_images(
@@ -65,10 +77,12 @@ async def io_upload_images(
 ):
     if not files:
         raise HTTPException(status_code=400, detail="Please upload at least one file.")
-    payloads = []
-    for f in files:
-        data = await f.read()
-        name = f.filename or f"image_{len(payloads)+1}.png"
-        payloads.append((name, data))
-    result = save_original_uploads(payloads, batch_id=batch_id, step=step)
-    return result
+    spool = UploadSpool()
+    try:
+        payloads = []
+        for f in files:
+            name = f.filename or f"image_{len(payloads)+1}.png"
+            payloads.append((name, await spool.add(f)))
+        return await save_original_uploads(payloads, batch_id=batch_id, step=step)
+    finally:
+        spool.close()
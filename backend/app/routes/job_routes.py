@@ -0,0 +1,50 @@
+# job_routes
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException
+
+from ..services.job_service import jobs
+from ..services.image_io_service import zip_streaming_response
+
+router = APIRouter(prefix="/process", tags=["Jobs"])
+
+@router.get("/stats")
+async def job_stats():
+    return jobs.stats()
+
+@router.get("/{job_id}/status")
+async def job_status(job_id: str):
+    return jobs.get(job_id).to_dict()
+
+@router.get("/{job_id}/results")
+async def job_results(job_id: str):
+    job = jobs.get(job_id)
+    items = [
+        {
+            "filename": item["filename"],
+            "stored_filename": item["stored_filename"],
+            "saved_path": item["saved_path"],
+        }
+        for item in job.items
+        if item["status"] == "done"
+    ]
+    failed = [item for item in job.items if item["status"] == "failed"]
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "batch_id": job.batch_id,
+        "step": job.step,
+        "items": items,
+        "failed": failed,
+    }
+
+@router.get("/{job_id}/download")
+async def job_download(job_id: str):
+    job = jobs.get(job_id)
+    done = [item for item in job.items if item["status"] == "done"]
+    if not done:
+        raise HTTPException(status_code=404, detail="No finished results for this job yet.")
+    return zip_streaming_response(
+        ((item["stored_filename"], Path(item["saved_path"])) for item in done),
+        f"{job.batch_id}-{job.step}.zip",
+    )
@@ -0,0 +1,225 @@
+#pipeline_routes
+import asyncio
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+from ..services.image_crop_service import ImageCropService
+from ..services.job_service import jobs, accepted_response
+from ..services.cache_service import content_key
+from ..services.batch_index_service import image_dimensions
+from ..services.image_io_service import (
+    validate_ext,
+    new_batch_id,
+    short_uid,
+    save_step_png,
+    save_mask_png,
+    load_step_items,
+    ingest_png,
+    lineage,
+    Source,
+    UploadSpool,
+    ITEM_WINDOW,
+)
+from .remove_bg_routes import svc as remove_bg_svc
+from .text2image_routes import svc as text2image_svc, _composite_one
+from .image_crop_routes import _crop_one
+
+router = APIRouter(prefix="/pipeline", tags=["Pipeline"])
+
+@router.post("/run")
+async def run_pipeline(
+    files: List[UploadFile] = File(...),
+    batch_id: Optional[str] = Form(None),
+    option: int = Form(..., ge=1, le=4),
+    prompt: str = Form(""),
+    preset: str = Form(..., description="instagram | shopee | amazon, a comma-separated list, or 'all'"),
+    size: str = Query("auto"),
+    concurrent: int = Query(3, ge=1, le=16),
+    background: int = Query(0, description="1 = return a job id immediately and process in the background"),
+):
+    """
+    Upload -> remove_bg -> text2image -> crop in one request. Every item moves on
+    to its next stage as soon as its previous one finishes, so compositing and
+    cropping of early items overlap with remove.bg calls for later ones.
+    """
+    try:
+        presets = ImageCropService.resolve_presets(preset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if option in (1, 2) and not prompt.strip():
+        raise HTTPException(status_code=400, detail="A prompt is required for generated backgrounds.")
+    spool = UploadSpool()
+    try:
+        uploads: List[tuple[str, Source]] = []
+        for f in files:
+            name = f.filename or f"image_{len(uploads)+1}.png"
+            validate_ext(name)
+            uploads.append((name, await spool.add(f)))
+        if not uploads:
+            raise HTTPException(status_code=400, detail="Please upload at least one file.")
+        bid = batch_id or new_batch_id()
+
+        def run(on_item: Optional[Callable[[int, dict], None]] = None):
+            return _run_pipeline(
+                uploads,
+                batch_id=bid,
+                option=option,
+                prompt=prompt,
+                presets=presets,
+                size=size,
+                concurrent=concurrent,
+                on_item=on_item,
+            )
+
+        if background:
+            job = jobs.submit(
+                "pipeline",
+                bid,
+                "crop",
+                [name for name, _ in uploads for _ in presets],
+                spool.hand_off(lambda job: run(job.finish_item)),
+            )
+            return JSONResponse(status_code=202, content=accepted_response(job))
+        results = await run()
+        if not any(item["ok"] for item in results):
+            raise HTTPException(
+                status_code=502,
+                detail={"message": "Pipeline failed for all images.", "errors": [r["error"] for r in results]},
+            )
+        return {"batch_id": bid, "items": results}
+    finally:
+        spool.close()
+
+async def _run_pipeline(
+    uploads: List[tuple[str, Source]],
+    *,
+    batch_id: str,
+    option: int,
+    prompt: str,
+    presets: List[str],
+    size: str,
+    concurrent: int,
+    on_item: Optional[Callable[[int, dict], None]] = None,
+) -> List[dict]:
+    interactive = len(uploads) == 1
+    remove_bg_slots = asyncio.Semaphore(concurrent)
+    # Bounds how many items are between ingest and crop (and so in memory) at once.
+    window = asyncio.Semaphore(max(ITEM_WINDOW, concurrent))
+    base_size = image_dimensions(uploads[0][1])
+    if None in base_size:
+        base_size = (1024, 1024)
+    # The background only depends on the request, so generate it while the
+    # first items are still at remove.bg.
+    background_task = asyncio.ensure_future(
+        text2image_svc.prepare_background(prompt, option, base_size, interactive=interactive)
+    )
+
+    async def background() -> tuple[Optional[bytes], Optional[str]]:
+        data = await asyncio.shield(background_task)
+        return data, content_key(data) if data else None
+
+    def background_failure() -> Optional[BaseException]:
+        if background_task.done() and not background_task.cancelled():
+            return background_task.exception()
+        return None
+
+    async def run_one(index: int, name: str, source: Source) -> dict:
+        async with window:
+            entry = await run_stages(name, source)
+        if on_item:
+            # Jobs track one item per crop output, like the crop route.
+            for k, result in enumerate(_job_results(entry, presets)):
+                on_item(index * len(presets) + k, result)
+        return entry
+
+    async def run_stages(name: str, source: Source) -> dict:
+        entry: dict = {"filename": name, "ok": False}
+        stage = "input"
+        try:
+            png = await ingest_png(name, source, interactive=interactive)
+            input_name = f"{Path(name).stem}_{short_uid()}.png"
+            save_step_png(batch_id, "input", input_name, png, source=lineage(None, name))
+            entry["input"] = input_name
+
+            stage = "remove_bg"
+            async with remove_bg_slots:
+                # Once the background has failed every item would fail at
+                # text2image anyway; skip the paid remove.bg call.
+                failure = background_failure()
+                if failure is not None:
+                    stage = "text2image"
+                    raise failure
+                cut = await remove_bg_svc.cutout(
+                    png,
+                    size=size,
+                    filename_hint=input_name,
+                    format="png",
+                    interactive=interactive,
+                    batch_id=batch_id,
+                    full_resolution=True,
+                )
+            cutout_name = f"{Path(input_name).stem}_{short_uid()}.png"
+            save_step_png(batch_id, "remove_bg", cutout_name, cut.content, source=lineage("input", input_name))
+            if cut.mask:
+                save_mask_png(batch_id, cutout_name, cut.mask)
+            entry["remove_bg"] = cutout_name
+            entry["engine"] = cut.engine
+
+            stage = "text2image"
+            background_bytes, background_key = await background()
+            composite = await _composite_one(
+                {"filename": cutout_name, "data": cut.content, "source": lineage("remove_bg", cutout_name)},
+                option=option,
+                background_bytes=background_bytes,
+                background_key=background_key,
+                mask_bytes=cut.mask,
+                batch_id=batch_id,
+                interactive=interactive,
+            )
+            if not composite["ok"]:
+                raise RuntimeError(composite["error"])
+            entry["text2image"] = composite["stored_filename"]
+
+            stage = "crop"
+            outcomes = await _crop_one(
+                composite["stored_filename"],
+                load_step_items(batch_id, "text2image", [composite["stored_filename"]])[0]["bytes"],
+                presets=presets,
+                box=None,
+                batch_id=batch_id,
+                origin_step="text2image",
+                interactive=interactive,
+            )
+            entry["crop"] = [result for result, _ in outcomes]
+            failed = [result["error"] for result in entry["crop"] if not result["ok"]]
+            if len(failed) == len(outcomes):
+                raise RuntimeError(failed[0])
+            entry["ok"] = True
+        except Exception as e:
+            detail = getattr(e, "detail", None)
+            entry["error"] = str(detail if detail is not None else e)
+            entry["failed_stage"] = stage
+        return entry
+
+    try:
+        return list(await asyncio.gather(*(run_one(i, name, source) for i, (name, source) in enumerate(uploads))))
+    finally:
+        if not background_task.done():
+            background_task.cancel()
+
+def _job_results(entry: dict, presets: List[str]) -> List[dict]:
+    """One result per preset, named after the upload and carrying its stage lineage."""
+    lineage_fields = {k: entry[k] for k in ("input", "remove_bg", "engine", "text2image") if k in entry}
+    crops = entry.get("crop") or [
+        {"ok": False, "preset": preset, "error": entry.get("error", "Pipeline failed")} for preset in presets
+    ]
+    results = []
+    for crop in crops:
+        result = {**crop, **lineage_fields, "filename": entry["filename"]}
+        if not crop["ok"] and "failed_stage" not in result:
+            result["failed_stage"] = entry.get("failed_stage", "crop")
+        results.append(result)
+    return results
@@ -1,19 +1,26 @@
 #remove_bg_routes
 import json
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 from fastapi import APIRouter, UploadFile, File, Form, Query, HTTPException
+from fastapi.responses import JSONResponse
 
 from ..services.remove_bg_service import RemoveBGService
+from ..services.job_service import jobs, accepted_response
+from ..services.upstream_limiter_service import get_limiter
 from ..services.image_io_service import (
     validate_ext,
     new_batch_id,
     short_uid,
     save_step_png,
+    save_mask_png,
     zip_paths_for_batch_step,
     load_step_items,
     allowed_step_regex,
+    lineage,
+    Source,
+    UploadSpool,
 )
 
 router = APIRouter(prefix="/remove-bg", tags=["Remove BG"])
@@ -32,15 +39,14 @@ def _parse_filename_list(raw: Optional[str]) -> Optional[List[str]]:
         raise HTTPException(status_code=400, detail="'filenames' must be a JSON list of strings.")
     return data
 
-async def _prepare_uploads(files: List[UploadFile]) -> List[tuple[str, bytes]]:
-    prepared: List[tuple[str, bytes]] = []
+async def _prepare_uploads(files: List[UploadFile], spool: UploadSpool) -> List[tuple[str, Source]]:
+    prepared: List[tuple[str, Source]] = []
     for f in files:
         if not f:
             continue
         validate_ext(f.filename or "")
-        raw = await f.read()
         name = f.filename or f"image_{len(prepared)+1}.png"
-        prepared.append((name, raw))
+        prepared.append((name, await spool.add(f)))
     if not prepared:
         raise HTTPException(status_code=400, detail="No files uploaded")
     return prepared
@@ -52,63 +58,89 @@ async def _collect_sources(
     batch_id: Optional[str],
     source_step: str,
     filenames_raw: Optional[str],
-) -> tuple[Optional[str], List[tuple[str, bytes]]]:
+    spool: UploadSpool,
+) -> tuple[Optional[str], List[tuple[str, Source]]]:
     uploads: List[UploadFile] = []
     if primary_file:
         uploads.append(primary_file)
     if files:
         uploads.extend(files)
     if uploads:
-        prepared = await _prepare_uploads(uploads)
+        prepared = await _prepare_uploads(uploads, spool)
         return batch_id, prepared
     if batch_id:
         names = _parse_filename_list(filenames_raw)
-        stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=True)
-        prepared = [(item["filename"], item["bytes"]) for item in stored]
+        stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=False)
+        prepared = [(item["filename"], Path(item["path"])) for item in stored]
         return batch_id, prepared
     raise HTTPException(status_code=400, detail="Provide uploads or a batch reference to process.")
 
 async def _run_remove_bg_pipeline(
-    prepared: List[tuple[str, bytes]],
+    prepared: List[tuple[str, Source]],
     *,
     batch_id: Optional[str],
     size: str,
     bg_color: Optional[str],
     bg_image_url: Optional[str],
     concurrent: int,
+    origin_step: Optional[str] = None,
+    on_item: Optional[Callable[[int, dict], None]] = None,
+    interactive: bool = False,
+    full_resolution: bool = False,
 ) -> tuple[str, List[dict]]:
     bid = batch_id or new_batch_id()
-    batch_results = await svc.batch_remove_background(
+    normalized: List[dict] = [{} for _ in prepared]
+
+    async def handle(index: int, result: dict) -> None:
+        original = prepared[index]
+        if result.get("ok"):
+            out_name = f"{Path(original[0]).stem}_{short_uid()}.png"
+            saved_path = save_step_png(
+                bid, "remove_bg", out_name, result["content"], source=lineage(origin_step, original[0])
+            )
+            if result.get("mask"):
+                save_mask_png(bid, out_name, result["mask"])
+            entry = {
+                "filename": original[0],
+                "ok": True,
+                "saved_path": saved_path,
+                "stored_filename": out_name,
+                "engine": result.get("engine"),
+            }
+        else:
+            entry = {
+                "filename": original[0],
+                "ok": False,
+                "error": result.get("error", "Unknown remove.bg error"),
+            }
+        if result.get("duplicate_of"):
+            entry["duplicate_of"] = result["duplicate_of"]
+        normalized[index] = entry
+        if on_item:
+            on_item(index, entry)
+
+    await svc.batch_remove_background(
         prepared,
         size=size,
         format="png",
         bg_color=bg_color,
         bg_image_url=bg_image_url,
         concurrent=concurrent,
+        on_result=handle,
+        interactive=interactive,
+        batch_id=bid,
+        full_resolution=full_resolution,
     )
-    normalized: List[dict] = []
-    for original, result in zip(prepared, batch_results):
-        if result.get("ok"):
-            out_name = f"{Path(original[0]).stem}_{short_uid()}.png"
-            saved_path = save_step_png(bid, "remove_bg", out_name, result["content"])
-            normalized.append(
-                {
-                    "filename": original[0],
-                    "ok": True,
-                    "saved_path": saved_path,
-                    "stored_filename": out_name,
-                }
-            )
-        else:
-            normalized.append(
-                {
-                    "filename": original[0],
-                    "ok": False,
-                    "error": result.get("error", "Unknown remove.bg error"),
-                }
-            )
     return bid, normalized
 
+@router.get("/cache")
+async def remove_bg_cache_stats():
+    return svc.stats()
+
+@router.get("/limiter")
+async def remove_bg_limiter_stats():
+    return get_limiter("remove_bg").stats()
+
 @router.post("")
 @router.post("/batch")
 async def remove_bg_process(
@@ -122,7 +154,10 @@ async def remove_bg_process(
     bg_image_url: Optional[str] = Query(None),
     as_zip: int = Query(0),
     concurrent: int = Query(3, ge=1, le=16),
+    full_resolution: int = Query(0, description="1 = upscale the mask back onto the original when `size` is smaller"),
+    background: int = Query(0, description="1 = return a job id immediately and process in the background"),
 ):
+    spool = UploadSpool()
     try:
         resolved_batch, prepared = await _collect_sources(
             primary_file=file,
@@ -130,7 +165,31 @@ async def remove_bg_process(
             batch_id=batch_id,
             source_step=source_step,
             filenames_raw=filenames,
+            spool=spool,
         )
+        origin_step = None if (file or files) else source_step
+        if background:
+            bid = resolved_batch or new_batch_id()
+            job = jobs.submit(
+                "remove_bg",
+                bid,
+                "remove_bg",
+                [name for name, _ in prepared],
+                spool.hand_off(
+                    lambda job: _run_remove_bg_pipeline(
+                        prepared,
+                        batch_id=bid,
+                        size=size,
+                        bg_color=bg_color,
+                        bg_image_url=bg_image_url,
+                        concurrent=concurrent,
+                        origin_step=origin_step,
+                        on_item=job.finish_item,
+                        full_resolution=bool(full_resolution),
+                    )
+                ),
+            )
+            return JSONResponse(status_code=202, content=accepted_response(job))
         bid, normalized = await _run_remove_bg_pipeline(
             prepared,
             batch_id=resolved_batch,
@@ -138,6 +197,9 @@ async def remove_bg_process(
             bg_color=bg_color,
             bg_image_url=bg_image_url,
             concurrent=concurrent if len(prepared) > 1 else 1,
+            origin_step=origin_step,
+            interactive=len(prepared) == 1,
+            full_resolution=bool(full_resolution),
         )
         successes = [item for item in normalized if item["ok"]]
         failures = [item for item in normalized if not item["ok"]]
@@ -148,8 +210,15 @@ async def remove_bg_process(
             )
         if as_zip and successes:
             return zip_paths_for_batch_step(bid, "remove_bg")
-        return {"batch_id": bid, "items": normalized, "failed": failures}
+        return {
+            "batch_id": bid,
+            "items": normalized,
+            "failed": failures,
+            "upstream_calls_saved": sum(1 for item in normalized if item.get("duplicate_of")),
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=502, detail={"message": ERROR_HINT, "errors": [str(e)]})
+    finally:
+        spool.close()
@@ -1,19 +1,28 @@
-import io
+import asyncio
 import json
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Optional, List
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from PIL import Image
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import JSONResponse
 
 from ..services.text2image_service import Text2ImageService
+from ..services.executor_service import run_cpu
+from ..services.job_service import jobs, accepted_response
+from ..services.cache_service import content_key
 from ..services.image_io_service import (
     save_step_png,
     new_batch_id,
     short_uid,
     load_step_items,
     allowed_step_regex,
+    lineage,
+    load_source,
+    mask_path,
+    UploadSpool,
+    ITEM_WINDOW,
 )
+from ..services.batch_index_service import image_dimensions
 
 router = APIRouter(prefix="/text2image", tags=["Text2Image"])
 svc = Text2ImageService()
@@ -30,6 +39,10 @@ def _parse_filename_list(raw: Optional[str]) -> Optional[List[str]]:
         raise HTTPException(status_code=400, detail="'filenames' must be a JSON list of strings.")
     return data
 
+@router.get("/cache")
+async def text2image_cache_stats():
+    return svc.background_cache_stats()
+
 @router.post("/generate")
 @router.post("/generate-single")
 @router.post("/batch-generate")
@@ -41,46 +54,48 @@ async def generate_text2image(
     filenames: Optional[str] = Form(None, description="JSON list of filenames to use"),
     foreground: Optional[UploadFile] = File(None),
     mask: Optional[UploadFile] = File(None),
+    background: int = Query(0, description="1 = return a job id immediately and process in the background"),
 ):
+    spool = UploadSpool()
     try:
         sources = await _resolve_sources(
             batch_id=batch_id,
             source_step=source_step,
             filenames_raw=filenames,
             foreground=foreground,
+            spool=spool,
         )
         if not sources:
             raise HTTPException(status_code=400, detail="No foreground images to process.")
-        mask_bytes = await mask.read() if mask else None
-        if mask_bytes and len(sources) != 1:
-            raise HTTPException(status_code=400, detail="Mask upload is only supported for a single foreground.")
+        if mask:
+            if len(sources) != 1:
+                raise HTTPException(status_code=400, detail="Mask upload is only supported for a single foreground.")
+            # An uploaded mask replaces any stored remove.bg mask of the item.
+            sources[0]["mask"] = await spool.add(mask)
         target_batch = batch_id or new_batch_id()
-        results = []
-        first_fg_bytes = sources[0]["bytes"]
-        with Image.open(io.BytesIO(first_fg_bytes)) as first_image:
-            base_size = first_image.size
-        base_background_bytes = svc.prepare_background(prompt, option, base_size)
-        for idx, item in enumerate(sources):
-            try:
-                fg_bytes = item["bytes"]
-                result_bytes = svc.composite_images(
-                    foreground_bytes=fg_bytes,
-                    mask_bytes=mask_bytes if mask_bytes and idx == 0 else None,
-                    option=option,
-                    background_bytes=base_background_bytes,
-                )
-                out_name = f"{Path(item['filename']).stem}_bg_{short_uid()}.png"
-                saved_path = save_step_png(target_batch, "text2image", out_name, result_bytes)
-                results.append(
-                    {
-                        "ok": True,
-                        "filename": item["filename"],
-                        "stored_filename": out_name,
-                        "saved_path": saved_path,
-                    }
-                )
-            except Exception as e:
-                results.append({"ok": False, "filename": item["filename"], "error": str(e)})
+        if background:
+            job = jobs.submit(
+                "text2image",
+                target_batch,
+                "text2image",
+                [item["filename"] for item in sources],
+                spool.hand_off(
+                    lambda job: _run_text2image_pipeline(
+                        sources,
+                        prompt=prompt,
+                        option=option,
+                        batch_id=target_batch,
+                        on_item=job.finish_item,
+                    )
+                ),
+            )
+            return JSONResponse(status_code=202, content=accepted_response(job))
+        results = await _run_text2image_pipeline(
+            sources,
+            prompt=prompt,
+            option=option,
+            batch_id=target_batch,
+        )
         successes = [item for item in results if item["ok"]]
         if not successes:
             raise HTTPException(status_code=500, detail="Failed to generate backgrounds for all images.")
@@ -89,6 +104,79 @@ async def generate_text2image(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        spool.close()
+
+async def _run_text2image_pipeline(
+    sources: List[dict],
+    *,
+    prompt: str,
+    option: int,
+    batch_id: str,
+    on_item: Optional[Callable[[int, dict], None]] = None,
+) -> List[dict]:
+    base_size = image_dimensions(sources[0]["data"])
+    if None in base_size:
+        raise ValueError(f"Could not read image '{sources[0]['filename']}'.")
+    base_background_bytes = await svc.prepare_background(
+        prompt, option, base_size, interactive=len(sources) == 1
+    )
+    # Hashed once here so workers can key their decoded-background cache without rehashing.
+    background_key = content_key(base_background_bytes) if base_background_bytes else None
+
+    window = asyncio.Semaphore(ITEM_WINDOW)
+
+    async def run_one(idx: int, item: dict) -> dict:
+        async with window:
+            result = await _composite_one(
+                item,
+                option=option,
+                background_bytes=base_background_bytes,
+                background_key=background_key,
+                batch_id=batch_id,
+                interactive=len(sources) == 1,
+            )
+        if on_item:
+            on_item(idx, result)
+        return result
+
+    return list(await asyncio.gather(*(run_one(idx, item) for idx, item in enumerate(sources))))
+
+async def _composite_one(
+    item: dict,
+    *,
+    option: int,
+    background_bytes: Optional[bytes],
+    batch_id: str,
+    mask_bytes: Optional[bytes] = None,
+    background_key: Optional[str] = None,
+    interactive: bool = False,
+) -> dict:
+    try:
+        foreground_bytes = await asyncio.to_thread(load_source, item["data"])
+        if mask_bytes is None and item.get("mask") is not None:
+            mask_bytes = await asyncio.to_thread(item["mask"].read_bytes)
+        result_bytes = await run_cpu(
+            svc.composite_images,
+            foreground_bytes=foreground_bytes,
+            mask_bytes=mask_bytes,
+            option=option,
+            background_bytes=background_bytes,
+            background_key=background_key,
+            interactive=interactive,
+        )
+        out_name = f"{Path(item['filename']).stem}_bg_{short_uid()}.png"
+        saved_path = save_step_png(
+            batch_id, "text2image", out_name, result_bytes, source=item.get("source")
+        )
+        return {
+            "ok": True,
+            "filename": item["filename"],
+            "stored_filename": out_name,
+            "saved_path": saved_path,
+        }
+    except Exception as e:
+        return {"ok": False, "filename": item["filename"], "error": str(e)}
 
 async def _resolve_sources(
     *,
@@ -96,18 +184,31 @@ async def _resolve_sources(
     source_step: str,
     filenames_raw: Optional[str],
     foreground: Optional[UploadFile],
+    spool: UploadSpool,
 ) -> List[dict]:
+    """
+    Items carry "data" as a path; it is read when the item is composited.
+    remove_bg items with a stored remove.bg mask also carry its path as "mask"
+    (the route replaces it with an uploaded mask).
+    """
     sources: List[dict] = []
     if foreground:
-        data = await foreground.read()
-        if not data:
-            raise HTTPException(status_code=400, detail="Uploaded foreground is empty.")
-        sources.append({"filename": foreground.filename or "foreground.png", "bytes": data})
+        name = foreground.filename or "foreground.png"
+        sources.append({"filename": name, "data": await spool.add(foreground), "source": lineage(None, name)})
         return sources
     if not batch_id:
         raise HTTPException(status_code=400, detail="batch_id is required when no upload is provided.")
     names = _parse_filename_list(filenames_raw)
-    stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=True)
+    stored = load_step_items(batch_id, source_step, filenames=names, include_bytes=False)
     for item in stored:
-        sources.append({"filename": item["filename"], "bytes": item["bytes"]})
+        entry = {
+            "filename": item["filename"],
+            "data": Path(item["path"]),
+            "source": lineage(source_step, item["filename"]),
+        }
+        if source_step == "remove_bg":
+            mask = mask_path(batch_id, item["filename"])
+            if mask.is_file():
+                entry["mask"] = mask
+        sources.append(entry)
     return sources
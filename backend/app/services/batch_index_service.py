@@ -0,0 +1,150 @@
+#batch_index_service
+import io
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from PIL import Image
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    batch_id   TEXT NOT NULL,
+    step       TEXT NOT NULL,
+    filename   TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    width      INTEGER,
+    height     INTEGER,
+    source     TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch_id, step, filename)
+);
+CREATE TABLE IF NOT EXISTS scanned (
+    batch_id TEXT NOT NULL,
+    step     TEXT NOT NULL,
+    PRIMARY KEY (batch_id, step)
+);
+"""
+_COLUMNS = ("batch_id", "step", "filename", "size", "width", "height", "source", "created_at", "updated_at")
+
+class BatchIndex:
+    """
+    SQLite index of every stored pipeline item, so listings and latest-step
+    lookups are a single indexed query instead of directory globs and stats.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def record(
+        self,
+        batch_id: str,
+        step: str,
+        filename: str,
+        *,
+        size: int,
+        width: Optional[int],
+        height: Optional[int],
+        source: Optional[str] = None,
+    ) -> None:
+        now = time.time()
+        self._conn().execute(
+            """
+            INSERT INTO items (batch_id, step, filename, size, width, height, source, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (batch_id, step, filename) DO UPDATE SET
+                size = excluded.size,
+                width = excluded.width,
+                height = excluded.height,
+                source = COALESCE(excluded.source, items.source),
+                updated_at = excluded.updated_at
+            """,
+            (batch_id, step, filename, size, width, height, source, now, now),
+        )
+
+    def record_scan(self, batch_id: str, step: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """Record rows found on disk for one step and mark the step as scanned, atomically."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            for row in rows:
+                self.record(**row)
+            conn.execute("INSERT OR IGNORE INTO scanned (batch_id, step) VALUES (?, ?)", (batch_id, step))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def scanned_steps(self, batch_id: str) -> Set[str]:
+        rows = self._conn().execute("SELECT step FROM scanned WHERE batch_id = ?", (batch_id,))
+        return {r[0] for r in rows}
+
+    def remove(self, batch_id: str, step: str, filenames: Iterable[str]) -> None:
+        self._conn().executemany(
+            "DELETE FROM items WHERE batch_id = ? AND step = ? AND filename = ?",
+            [(batch_id, step, name) for name in filenames],
+        )
+
+    def list(
+        self,
+        batch_id: str,
+        step: str,
+        *,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM items WHERE batch_id = ? AND step = ? "
+            "ORDER BY filename LIMIT ? OFFSET ?",
+            (batch_id, step, -1 if limit is None else limit, max(0, offset)),
+        )
+        return [dict(r) for r in rows]
+
+    def get(self, batch_id: str, step: str, filenames: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        names = list(filenames)
+        found: Dict[str, Dict[str, Any]] = {}
+        # Stay under SQLite's bound-parameter limit for very large selections.
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            rows = self._conn().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM items WHERE batch_id = ? AND step = ? "
+                f"AND filename IN ({', '.join('?' * len(chunk))})",
+                (batch_id, step, *chunk),
+            )
+            found.update((r["filename"], dict(r)) for r in rows)
+        return found
+
+    def count(self, batch_id: str, step: str) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM items WHERE batch_id = ? AND step = ?", (batch_id, step)
+        ).fetchone()
+        return int(row[0])
+
+    def step_counts(self, batch_id: str) -> Dict[str, int]:
+        rows = self._conn().execute(
+            "SELECT step, COUNT(*) FROM items WHERE batch_id = ? GROUP BY step", (batch_id,)
+        )
+        return {r[0]: int(r[1]) for r in rows}
+
+def image_dimensions(source: Union[bytes, Path]) -> Tuple[Optional[int], Optional[int]]:
+    """Read width/height from the image header without decoding pixels."""
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as im:
+            return im.width, im.height
+    except Exception:
+        return None, None
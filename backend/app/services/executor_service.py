@@ -0,0 +1,135 @@
+#executor_service
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+from .metrics_service import STAGE_IN_FLIGHT, observe_stage
+
+# IMAGE_WORKERS=0 runs CPU work on a thread instead (handy when debugging).
+CPU_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+# Batch submissions in flight at once; keeps queued payloads (and IPC memory) bounded
+# so an interactive request never sits behind an entire batch.
+MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(max(1, CPU_WORKERS) * 2)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+# Batch submissions waiting for / holding a slot; only touched on the event loop.
+_batch_waiting = 0
+_batch_running = 0
+
+class _WorkerHTTPError(Exception):
+    """HTTPException does not survive pickling, so it crosses the process boundary as this."""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _invoke(fn: Callable, args: tuple, kwargs: dict):
+    try:
+        return fn(*args, **kwargs)
+    except HTTPException as e:
+        raise _WorkerHTTPError(e.status_code, e.detail)
+
+def _noop() -> None:
+    return None
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if CPU_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, MAX_PENDING))
+    return _slots
+
+@contextlib.asynccontextmanager
+async def _batch_slot():
+    global _batch_waiting, _batch_running
+    slots = _get_slots()
+    _batch_waiting += 1
+    try:
+        await slots.acquire()
+    finally:
+        _batch_waiting -= 1
+    _batch_running += 1
+    try:
+        yield
+    finally:
+        _batch_running -= 1
+        slots.release()
+
+async def startup_executor() -> None:
+    """Spawn and warm every worker up front so the first request does not pay for it."""
+    pool = get_pool()
+    if pool is None:
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(pool, _noop) for _ in range(CPU_WORKERS)))
+
+async def shutdown_executor() -> None:
+    global _pool, _slots
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+    _pool = None
+    _slots = None
+
+async def run_cpu(fn: Callable, *args, interactive: bool = False, **kwargs):
+    """
+    Run a picklable, module- or class-level function on the shared process pool.
+    Batch callers are throttled to MAX_PENDING submissions; `interactive=True`
+    skips that queue so single-image requests stay low latency. Functions
+    tagged with metrics_service.instrumented are timed here, since metrics
+    recorded inside a worker process never reach /metrics.
+    """
+    pool = get_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    call = functools.partial(_invoke, fn, args, kwargs)
+    try:
+        if interactive:
+            return await _submit(loop, pool, call, getattr(fn, "__stage__", None))
+        async with _batch_slot():
+            return await _submit(loop, pool, call, getattr(fn, "__stage__", None))
+    except _WorkerHTTPError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def _submit(loop: asyncio.AbstractEventLoop, pool: ProcessPoolExecutor, call: Callable, stage: Optional[str]):
+    if stage is None:
+        return await loop.run_in_executor(pool, call)
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    began = time.perf_counter()
+    failed = True
+    try:
+        result = await loop.run_in_executor(pool, call)
+        failed = False
+        return result
+    finally:
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        observe_stage(stage, time.perf_counter() - began, failed=failed)
+
+def pool_stats() -> dict:
+    return {
+        "workers": CPU_WORKERS,
+        "max_pending": MAX_PENDING,
+        "started": _pool is not None,
+        "batch_running": _batch_running,
+        "batch_slots_free": max(1, MAX_PENDING) - _batch_running,
+        "batch_waiting": _batch_waiting,
+    }
@@ -0,0 +1,86 @@
+#http_client_service
+import os
+from typing import Dict
+
+import httpx
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+HTTP2_ENABLED = os.getenv("UPSTREAM_HTTP2", "1") != "0" and _http2_available()
+
+# One long-lived client per upstream so keep-alive connections (and HTTP/2
+# streams) are actually reused across requests.
+UPSTREAMS: Dict[str, dict] = {
+    "remove_bg": {
+        "max_connections": int(os.getenv("REMOVE_BG_POOL_MAX_CONNECTIONS", "20")),
+        "max_keepalive": int(os.getenv("REMOVE_BG_POOL_MAX_KEEPALIVE", "10")),
+        "timeout_s": 60.0,
+    },
+    "openai_download": {
+        "max_connections": int(os.getenv("OPENAI_DOWNLOAD_POOL_MAX_CONNECTIONS", "10")),
+        "max_keepalive": int(os.getenv("OPENAI_DOWNLOAD_POOL_MAX_KEEPALIVE", "5")),
+        "timeout_s": 60.0,
+    },
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    conf = UPSTREAMS[name]
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        timeout=httpx.Timeout(conf["timeout_s"]),
+        limits=httpx.Limits(
+            max_connections=conf["max_connections"],
+            max_keepalive_connections=conf["max_keepalive"],
+            keepalive_expiry=30.0,
+        ),
+    )
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream, creating it on first use."""
+    if name not in UPSTREAMS:
+        raise KeyError(f"Unknown upstream '{name}'")
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _build_client(name)
+    return client
+
+async def startup_clients() -> None:
+    for name in UPSTREAMS:
+        get_client(name)
+
+async def shutdown_clients() -> None:
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+
+def pool_stats() -> Dict[str, dict]:
+    stats: Dict[str, dict] = {}
+    for name, conf in UPSTREAMS.items():
+        client = _clients.get(name)
+        entry = {
+            "open": client is not None and not client.is_closed,
+            "http2": HTTP2_ENABLED,
+            "max_connections": conf["max_connections"],
+            "max_keepalive": conf["max_keepalive"],
+            "connections": 0,
+            "idle": 0,
+            "http2_connections": 0,
+            "requests_in_flight": 0,
+        }
+        # httpx does not expose pool state publicly; read it from the httpcore pool.
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is not None:
+            conns = list(pool.connections)
+            entry["connections"] = len(conns)
+            entry["idle"] = sum(1 for c in conns if c.is_idle())
+            entry["http2_connections"] = sum(1 for c in conns if "HTTP/2" in c.info())
+            entry["requests_in_flight"] = len(getattr(pool, "_requests", []))
+        stats[name] = entry
+    return stats
@@ -1,9 +1,15 @@
 import io
-import zipfile
-from typing import Optional, Dict, Any, List, Tuple
+import math
+import os
+from typing import Optional, Dict, Any, List, Tuple, Iterator
 from PIL import Image
 from fastapi.responses import StreamingResponse
-from ..services.image_io_service import save_step_png  # 배치 저장용
+from ..services.image_io_service import encode_for_step, save_step_png, zip_streaming_response  # 배치 저장용
+from ..services.metrics_service import instrumented
+
+# Oversampling kept before the final LANCZOS pass, once JPEGs are drafted down
+# to the output size and other sources box-reduced (benchmarks/bench_crop.py).
+CROP_REDUCING_GAP = float(os.getenv("CROP_REDUCING_GAP", "1.5"))
 
 class ImageCropService:
     PRESETS = {
@@ -23,6 +29,27 @@ class ImageCropService:
             headers={"Content-Disposition": f'inline; filename="{filename}"'}
         )
 
+    @classmethod
+    def resolve_presets(cls, raw: str) -> List[str]:
+        """Parse 'instagram', 'instagram,amazon' or 'all' into preset names."""
+        if raw.strip().lower() == "all":
+            return list(cls.PRESETS)
+        presets: List[str] = []
+        for name in (part.strip().lower() for part in raw.split(",")):
+            if not name:
+                continue
+            if name not in cls.PRESETS:
+                raise ValueError(f"Invalid preset '{name}'")
+            if name not in presets:
+                presets.append(name)
+        if not presets:
+            raise ValueError("At least one preset is required")
+        return presets
+
+    @staticmethod
+    def output_name(preset: str, filename: str) -> str:
+        return f"{preset}_crop_{filename or 'image'}.png"
+
     @classmethod
     def process_one_png(
         cls,
@@ -33,31 +60,145 @@ class ImageCropService:
     ) -> Tuple[str, bytes]:
         if preset not in cls.PRESETS:
             raise ValueError(f"Invalid preset '{preset}'")
+        _, out_name, out_png = cls.process_many_png(img_bytes, filename, [preset], box)[0]
+        return out_name, out_png
 
-        meta = cls.PRESETS[preset]
-        target_ratio = meta["ratio"]
-        target_size = meta["size"]
+    @classmethod
+    @instrumented("crop")
+    def process_many_png(
+        cls,
+        img_bytes: bytes,
+        filename: str,
+        presets: List[str],
+        box: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[str, str, bytes]]:
+        """
+        Produce every requested preset from a single decode.
+        Returns (preset, out_name, png_bytes) in the order of `presets`.
+        """
+        for preset in presets:
+            if preset not in cls.PRESETS:
+                raise ValueError(f"Invalid preset '{preset}'")
+        rendered = cls._render(img_bytes, presets, box)
+        outputs: List[Tuple[str, str, bytes]] = []
+        for preset in presets:
+            outputs.append(
+                (preset, cls.output_name(preset, filename), encode_for_step(rendered[preset], "crop"))
+            )
+        return outputs
 
+    @classmethod
+    def _render(
+        cls,
+        img_bytes: bytes,
+        presets: List[str],
+        box: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Image.Image]:
+        """
+        Presets sharing an aspect ratio share one crop box, and smaller sizes
+        are resampled from the largest output of that ratio when that output
+        is a downscale of the crop region; otherwise each size is resampled
+        from the region directly.
+        """
         img = Image.open(io.BytesIO(img_bytes))
-        img.load()
+        # Crop geometry comes from the header; pixels are decoded only once we
+        # know how much resolution the outputs actually need.
+        by_ratio: Dict[float, List[str]] = {}
+        for preset in presets:
+            by_ratio.setdefault(cls.PRESETS[preset]["ratio"], []).append(preset)
+        regions = []
+        for ratio, group in by_ratio.items():
+            group.sort(key=lambda p: cls.PRESETS[p]["size"][0] * cls.PRESETS[p]["size"][1], reverse=True)
+            regions.append((cls._crop_box_for(img.size, ratio, box), cls.PRESETS[group[0]]["size"]))
+        crop_boxes = cls._draft_for(img, regions)
+
+        rendered: Dict[str, Image.Image] = {}
+        for (ratio, group), crop_box in zip(by_ratio.items(), crop_boxes):
+            largest_size = cls.PRESETS[group[0]]["size"]
+            region, crop_box = cls._reduce_region(img, crop_box, largest_size)
+            largest = region.resize(largest_size, Image.LANCZOS, box=crop_box, reducing_gap=CROP_REDUCING_GAP)
+            rendered[group[0]] = largest
+            # Chaining is only safe when the largest render is itself a
+            # downscale; an upscaled render would blur the smaller presets.
+            chain = (
+                crop_box[2] - crop_box[0] >= largest_size[0]
+                and crop_box[3] - crop_box[1] >= largest_size[1]
+            )
+            for preset in group[1:]:
+                size = cls.PRESETS[preset]["size"]
+                if chain:
+                    rendered[preset] = largest.resize(size, Image.LANCZOS, reducing_gap=CROP_REDUCING_GAP)
+                else:
+                    rendered[preset] = region.resize(
+                        size, Image.LANCZOS, box=crop_box, reducing_gap=CROP_REDUCING_GAP
+                    )
+        return rendered
 
+    @classmethod
+    def _crop_box_for(
+        cls,
+        size: Tuple[int, int],
+        ratio: float,
+        box: Optional[Dict[str, Any]],
+    ) -> Tuple[int, int, int, int]:
         if box and all(k in box for k in ("x", "y", "width", "height")):
-            cropped = cls._crop_at_position_with_ratio(
-                img,
-                target_ratio,
+            return cls._position_crop_box(
+                size,
+                ratio,
                 int(box["x"]),
                 int(box["y"]),
                 int(box["width"]),
                 int(box["height"]),
             )
-        else:
-            cropped = cls._center_crop_to_ratio(img, target_ratio)
+        return cls._center_crop_box(size, ratio)
 
-        resized = cls._resize_image(cropped, target_size)
+    @staticmethod
+    def _draft_for(
+        img: Image.Image,
+        regions: List[Tuple[Tuple[int, int, int, int], Tuple[int, int]]],
+    ) -> List[Tuple[float, float, float, float]]:
+        """
+        For JPEGs, switch the decoder to the smallest DCT scale that still
+        decodes every (crop_box, output size) region at least at output size,
+        and return the crop boxes in the drafted coordinates. The resize's
+        reducing_gap then keeps the final LANCZOS pass oversampled.
+        """
+        if img.format != "JPEG":
+            return [box for box, _ in regions]
+        src_w, src_h = img.size
+        need_w = need_h = 0
+        for (left, top, right, bottom), size in regions:
+            need_w = max(need_w, math.ceil(src_w * size[0] / (right - left)))
+            need_h = max(need_h, math.ceil(src_h * size[1] / (bottom - top)))
+        if need_w >= src_w or need_h >= src_h:
+            return [box for box, _ in regions]
+        img.draft(img.mode, (need_w, need_h))
+        sx, sy = img.size[0] / src_w, img.size[1] / src_h
+        return [(l * sx, t * sy, r * sx, b * sy) for (l, t, r, b), _ in regions]
 
-        out_buf = io.BytesIO()
-        resized.save(out_buf, format="PNG")
-        return (f"{preset}_crop_{filename or 'image'}.png", out_buf.getvalue())
+    @staticmethod
+    def _reduce_region(
+        img: Image.Image,
+        crop_box: Tuple[float, float, float, float],
+        size: Tuple[int, int],
+    ) -> Tuple[Image.Image, Tuple[float, float, float, float]]:
+        """
+        Box-reduce the crop region of a non-JPEG source by the largest integer
+        factor that keeps it CROP_REDUCING_GAP times oversampled for `size`.
+        Cropping first means RGBA sources are premultiplied over the region
+        only. Returns (image, crop box within it); JPEGs are already drafted.
+        """
+        left, top, right, bottom = crop_box
+        factor = min(
+            int((right - left) / (size[0] * CROP_REDUCING_GAP)),
+            int((bottom - top) / (size[1] * CROP_REDUCING_GAP)),
+        )
+        if img.format == "JPEG" or (factor < 2 and img.mode not in ("RGBA", "LA")):
+            return img, crop_box
+        region = img.crop(tuple(int(v) for v in crop_box))
+        if factor >= 2:
+            region = region.reduce(factor)
+        return region, (0, 0, *region.size)
 
     @classmethod
     def batch_process_zip(
@@ -67,51 +208,44 @@ class ImageCropService:
         boxes_map: Optional[Dict[str, Dict[str, Any]]] = None,
         batch_id: Optional[str] = None
     ) -> StreamingResponse:
-        zip_buf = io.BytesIO()
-        with zipfile.ZipFile(zip_buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        def entries() -> Iterator[Tuple[str, bytes]]:
+            # Crops are produced lazily as the archive streams out.
             for filename, content in files:
                 try:
                     box = boxes_map.get(filename) if boxes_map else None
                     out_name, out_png = cls.process_one_png(content, filename, preset, box)
                     if batch_id:
                         save_step_png(batch_id, "crop", out_name, out_png)
-                    zf.writestr(out_name, out_png)
+                    yield out_name, out_png
                 except Exception as e:
-                    zf.writestr(f"ERROR_{filename or 'unknown'}.txt", str(e))
+                    yield f"ERROR_{filename or 'unknown'}.txt", str(e).encode()
 
-        zip_buf.seek(0)
-        return StreamingResponse(
-            zip_buf,
-            media_type="application/zip",
-            headers={"Content-Disposition": 'attachment; filename="batch_crops.zip"'}
-        )
+        return zip_streaming_response(entries(), "batch_crops.zip")
 
     @staticmethod
-    def _center_crop_to_ratio(img: Image.Image, target_ratio: float) -> Image.Image:
-        w, h = img.size
+    def _center_crop_box(size: Tuple[int, int], target_ratio: float) -> Tuple[int, int, int, int]:
+        w, h = size
         current_ratio = w / h
         if abs(current_ratio - target_ratio) < 1e-3:
-            return img
+            return (0, 0, w, h)
         if current_ratio > target_ratio:
             new_w = int(h * target_ratio)
             left = max(0, (w - new_w) // 2)
-            box = (left, 0, left + new_w, h)
-        else:
-            new_h = int(w / target_ratio)
-            top = max(0, (h - new_h) // 2)
-            box = (0, top, w, top + new_h)
-        return img.crop(box)
+            return (left, 0, left + new_w, h)
+        new_h = int(w / target_ratio)
+        top = max(0, (h - new_h) // 2)
+        return (0, top, w, top + new_h)
 
     @staticmethod
-    def _crop_at_position_with_ratio(
-        img: Image.Image,
+    def _position_crop_box(
+        size: Tuple[int, int],
         target_ratio: float,
         x: int,
         y: int,
         width: int,
         height: int,
-    ) -> Image.Image:
-        w, h = img.size
+    ) -> Tuple[int, int, int, int]:
+        w, h = size
         width = max(1, min(width, w))
         height = max(1, min(height, h))
         x = max(0, min(x, w - 1))
@@ -129,8 +263,4 @@ class ImageCropService:
         top = int(max(0, min(cy - height / 2, h - height)))
         right = int(min(w, left + width))
         bottom = int(min(h, top + height))
-        return img.crop((left, top, right, bottom))
-
-    @staticmethod
-    def _resize_image(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
-        return img.resize(size, Image.LANCZOS)
+        return (left, top, right, bottom)
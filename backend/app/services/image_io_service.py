@@ -1,19 +1,70 @@
 #image_io_service
+import asyncio
+import hashlib
 import io
+import os
+import shutil
+import tempfile
+import time
 import uuid
 import zipfile
 from pathlib import Path
-from typing import List, Optional, Sequence, Tuple, Dict, Any
+from typing import List, Optional, Sequence, Tuple, Dict, Any, Awaitable, Callable, Hashable, Iterable, Iterator, Union
 
 from PIL import Image
-from fastapi import HTTPException
+from fastapi import HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
 
+from .executor_service import CPU_WORKERS, run_cpu
+from .batch_index_service import BatchIndex, image_dimensions
+from .cache_service import MemoryLRUCache
+from .metrics_service import instrumented
+
 OUTPUTS_ROOT = Path(__file__).resolve().parents[1] / "outputs"
 ALLOWED_EXT = {".jpg", ".jpeg", ".png", ".webp"}
 STEPS: Tuple[str, ...] = ("input", "remove_bg", "text2image", "crop")
 MIN_WIDTH = 512
 MIN_HEIGHT = 512
+# Already-compressed formats gain nothing from deflate; store them as-is.
+ZIP_STORED_EXT = {".png", ".jpg", ".jpeg", ".webp", ".zip"}
+ZIP_CHUNK_SIZE = 1024 * 1024
+INDEX_FILENAME = "index.sqlite3"
+# remove.bg alpha masks live beside the step folders, keyed by cutout filename;
+# they are not a step of their own and are not indexed.
+MASK_DIRNAME = "remove_bg_masks"
+
+# PNG save options per profile. zlib level dominates encode time: level 1 is
+# roughly 3x faster than Pillow's default 6 for ~1.5x the bytes.
+ENCODE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "raw": {"compress_level": 0},
+    "fast": {"compress_level": 1},
+    "final": {"compress_level": 6},
+    "small": {"compress_level": 9},
+}
+# Intermediates are only read back by the next stage; crop is what gets delivered.
+# Override per step with ENCODE_PROFILE_<STEP>, e.g. ENCODE_PROFILE_CROP=small.
+STEP_ENCODE_PROFILES: Dict[str, str] = {
+    step: os.getenv(f"ENCODE_PROFILE_{step.upper()}", default)
+    for step, default in (("input", "fast"), ("remove_bg", "fast"), ("text2image", "fast"), ("crop", "final"))
+}
+# Recently stored step outputs, so the next step in a chain reads them from
+# memory. Holds encoded bytes: decoding happens in pool workers, which cannot
+# share pixel buffers with this process.
+STEP_CACHE_MAX_BYTES = int(os.getenv("STEP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Uploads are streamed to disk in chunks and read back one item at a time.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_REQUEST_UPLOAD_BYTES = int(os.getenv("MAX_REQUEST_UPLOAD_BYTES", str(4 * 1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Items a batch stage holds in memory at once (read, processed, saved); at
+# least one per CPU worker so batch stages can keep the whole pool busy.
+ITEM_WINDOW = int(os.getenv("ITEM_WINDOW", str(max(8, CPU_WORKERS))))
+
+# An item's payload: bytes in memory, or a file that is read only when needed.
+Source = Union[bytes, Path]
+
+_index: Optional[BatchIndex] = None
+_step_cache = MemoryLRUCache("step_outputs", STEP_CACHE_MAX_BYTES)
 
 def new_batch_id() -> str:
     return uuid.uuid4().hex[:12]
@@ -25,39 +76,235 @@ def validate_ext(filename: str) -> None:
     if Path(filename).suffix.lower() not in ALLOWED_EXT:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-def to_png_rgba_bytes(data: bytes) -> bytes:
-    from io import BytesIO
-    with Image.open(BytesIO(data)) as im:
-        if im.width < MIN_WIDTH or im.height < MIN_HEIGHT:
-            raise HTTPException(status_code=400, detail=f"Image too small: {im.width}x{im.height}. Minimum is {MIN_WIDTH}x{MIN_HEIGHT}.")
-        out = BytesIO()
-        im.convert("RGBA").save(out, format="PNG")
-        return out.getvalue()
+# Not instrumented: it runs nested inside pooled stages (crop, composite,
+# ingest), where only run_cpu's timing reaches this process's registry.
+def encode_for_step(img: Image.Image, step: str) -> bytes:
+    """PNG-encode an image with the profile configured for the step it is stored under."""
+    profile = STEP_ENCODE_PROFILES.get(step, "final")
+    out = io.BytesIO()
+    img.save(out, format="PNG", **ENCODE_PROFILES.get(profile, ENCODE_PROFILES["final"]))
+    return out.getvalue()
+
+def _open_source(data: Source) -> Image.Image:
+    return Image.open(data if isinstance(data, Path) else io.BytesIO(data))
+
+def _check_min_size(width: int, height: int) -> None:
+    if width < MIN_WIDTH or height < MIN_HEIGHT:
+        raise HTTPException(status_code=400, detail=f"Image too small: {width}x{height}. Minimum is {MIN_WIDTH}x{MIN_HEIGHT}.")
+
+def probe_upload(name: str, data: Source) -> bool:
+    """
+    Validate an upload from its header alone (no pixel decode). Returns True
+    when it is already an RGBA PNG and can be stored without re-encoding.
+    """
+    try:
+        with _open_source(data) as im:
+            width, height, fmt, mode = im.width, im.height, im.format, im.mode
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"'{name}' is not a readable image.")
+    _check_min_size(width, height)
+    return fmt == "PNG" and mode == "RGBA"
+
+def verified_png_bytes(data: Source) -> bytes:
+    """Return an RGBA PNG as-is after a chunk/CRC check, which needs no decode."""
+    raw = load_source(data)
+    with Image.open(io.BytesIO(raw)) as im:
+        im.verify()
+    return raw
+
+@instrumented("ingest")
+def to_png_rgba_bytes(data: Source, step: str = "input") -> bytes:
+    with _open_source(data) as im:
+        _check_min_size(im.width, im.height)
+        return encode_for_step(im.convert("RGBA"), step)
+
+async def ingest_png(name: str, data: Source, step: str = "input", *, interactive: bool = False) -> bytes:
+    """Header-validate one upload, then pass it through or convert it on the process pool."""
+    if await asyncio.to_thread(probe_upload, name, data):
+        return await asyncio.to_thread(verified_png_bytes, data)
+    return await run_cpu(to_png_rgba_bytes, data, step, interactive=interactive)
 
 def ensure_step(step: str) -> str:
     if step not in STEPS:
         raise HTTPException(status_code=400, detail=f"Unknown pipeline step '{step}'")
     return step
 
-def save_step_png(batch_id: str, step: str, filename: str, png_bytes: bytes) -> str:
+def batch_index() -> BatchIndex:
+    global _index
+    db_path = OUTPUTS_ROOT / INDEX_FILENAME
+    if _index is None or _index.db_path != db_path:
+        _index = BatchIndex(db_path)
+    return _index
+
+def lineage(step: Optional[str], filename: str) -> str:
+    """Source reference recorded with a stored item; uploads have no step."""
+    return f"{step or 'upload'}/{filename}"
+
+@instrumented("disk_write")
+def save_step_png(
+    batch_id: str,
+    step: str,
+    filename: str,
+    png_bytes: Union[bytes, Image.Image],
+    *,
+    source: Optional[str] = None,
+) -> str:
+    """
+    Atomically store one step output and index it. Images are encoded with the
+    step's profile; bytes are taken as already encoded (see encode_for_step).
+    """
     ensure_step(step)
+    if isinstance(png_bytes, Image.Image):
+        png_bytes = encode_for_step(png_bytes, step)
     out_dir = OUTPUTS_ROOT / batch_id / step
     out_dir.mkdir(parents=True, exist_ok=True)
     path = out_dir / filename
-    with open(path, "wb") as f:
+    tmp = out_dir / f".{filename}.tmp"
+    with open(tmp, "wb") as f:
         f.write(png_bytes)
+    os.replace(tmp, path)
+    _step_cache.set((batch_id, step, filename), png_bytes)
+    width, height = image_dimensions(png_bytes)
+    batch_index().record(
+        batch_id, step, filename, size=len(png_bytes), width=width, height=height, source=source
+    )
     return str(path)
 
-def list_step_paths(batch_id: str, step: str) -> List[Path]:
+def mask_path(batch_id: str, filename: str) -> Path:
+    return OUTPUTS_ROOT / batch_id / MASK_DIRNAME / filename
+
+@instrumented("disk_write")
+def save_mask_png(batch_id: str, filename: str, mask_bytes: bytes) -> Path:
+    """Store the alpha mask of a remove_bg output under the cutout's filename."""
+    path = mask_path(batch_id, filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{filename}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(mask_bytes)
+    os.replace(tmp, path)
+    return path
+
+def _read_step_bytes(batch_id: str, step: str, path: Path) -> bytes:
+    data = _step_cache.get((batch_id, step, path.name))
+    if data is None:
+        data = path.read_bytes()
+        _step_cache.set((batch_id, step, path.name), data)
+    return data
+
+def load_source(source: Source) -> bytes:
+    """Materialize an item payload; stored step outputs go through the step cache."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    path = Path(source)
+    try:
+        batch_id, step, _ = path.relative_to(OUTPUTS_ROOT).parts
+    except ValueError:
+        return path.read_bytes()
+    return _read_step_bytes(batch_id, step, path)
+
+def source_digest(source: Source) -> str:
+    """sha256 of an item payload, streamed for paths; equals content_key(data) for the same bytes."""
+    h = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        h.update(source)
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+async def group_duplicates(sources: Sequence[Source], extra: Sequence[Hashable] = ()) -> List[List[int]]:
+    """
+    Hash every payload (plus an optional per-item key such as a crop box) and
+    group identical items. Returns index lists in first-seen order; the first
+    index of each group is the one to process.
+    """
+    digests = await asyncio.gather(*(asyncio.to_thread(source_digest, s) for s in sources))
+    groups: Dict[Tuple[str, Hashable], List[int]] = {}
+    for index, digest in enumerate(digests):
+        groups.setdefault((digest, extra[index] if extra else None), []).append(index)
+    return list(groups.values())
+
+def step_cache_stats() -> dict:
+    return _step_cache.stats()
+
+def _ensure_indexed(batch_id: str, steps: Sequence[str] = STEPS) -> None:
+    """
+    Reconcile each (batch, step) with the directory once, so files written
+    before the index existed are listed alongside newer indexed saves.
+    """
+    base = OUTPUTS_ROOT / batch_id
+    if not base.is_dir():
+        return
+    index = batch_index()
+    done = index.scanned_steps(batch_id)
+    for step in steps:
+        if step in done:
+            continue
+        paths = [p for p in sorted((base / step).glob("*.png")) if p.is_file()]
+        known = index.get(batch_id, step, [p.name for p in paths])
+        rows = []
+        for p in paths:
+            if p.name in known:
+                continue
+            width, height = image_dimensions(p)
+            rows.append(
+                {
+                    "batch_id": batch_id,
+                    "step": step,
+                    "filename": p.name,
+                    "size": p.stat().st_size,
+                    "width": width,
+                    "height": height,
+                }
+            )
+        index.record_scan(batch_id, step, rows)
+
+def _drop_missing(batch_id: str, step: str, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows whose file still exists; rows for files deleted from disk are removed from the index and cache."""
+    live, gone = [], []
+    for row in rows:
+        (live if (OUTPUTS_ROOT / batch_id / step / row["filename"]).is_file() else gone).append(row)
+    if gone:
+        batch_index().remove(batch_id, step, [row["filename"] for row in gone])
+        for row in gone:
+            _step_cache.pop((batch_id, step, row["filename"]))
+    return live
+
+def _with_path(batch_id: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    row["path"] = str(OUTPUTS_ROOT / batch_id / row["step"] / row["filename"])
+    return row
+
+def list_step_items(
+    batch_id: str,
+    step: str,
+    *,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    ensure_step(step)
+    _ensure_indexed(batch_id, [step])
+    index = batch_index()
+    while True:
+        rows = index.list(batch_id, step, offset=offset, limit=limit)
+        live = _drop_missing(batch_id, step, rows)
+        if len(live) == len(rows):
+            return [_with_path(batch_id, row) for row in live]
+        # Deleted files shifted the page; read it again.
+
+def count_step_items(batch_id: str, step: str) -> int:
     ensure_step(step)
-    base = OUTPUTS_ROOT / batch_id / step
-    if not base.exists():
-        return []
-    return sorted(p for p in base.glob("*.png") if p.is_file())
+    _ensure_indexed(batch_id, [step])
+    return batch_index().count(batch_id, step)
+
+def list_step_paths(batch_id: str, step: str) -> List[Path]:
+    return [Path(row["path"]) for row in list_step_items(batch_id, step)]
 
 def detect_latest_step(batch_id: str) -> Optional[str]:
+    _ensure_indexed(batch_id)
+    counts = batch_index().step_counts(batch_id)
     for step in reversed(STEPS):
-        if any(list_step_paths(batch_id, step)):
+        if counts.get(step) and list_step_items(batch_id, step, limit=1):
             return step
     return None
 
@@ -73,28 +320,25 @@ def load_step_items(
     it must be a sequence of exact matches and preserves the incoming order.
     """
     ensure_step(step)
-    available = {p.name: p for p in list_step_paths(batch_id, step)}
-    if not available:
+    _ensure_indexed(batch_id, [step])
+    index = batch_index()
+    if not index.count(batch_id, step):
         raise HTTPException(
             status_code=404,
             detail=f"No files found for batch '{batch_id}' step '{step}'.",
         )
     if filenames:
-        selected_paths: List[Path] = []
-        missing = []
-        for name in filenames:
-            path = available.get(name)
-            if not path:
-                missing.append(name)
-            else:
-                selected_paths.append(path)
+        found = index.get(batch_id, step, filenames)
+        found = {row["filename"]: row for row in _drop_missing(batch_id, step, found.values())}
+        missing = [name for name in filenames if name not in found]
         if missing:
             raise HTTPException(
                 status_code=404,
                 detail=f"Missing files for batch '{batch_id}' step '{step}': {', '.join(missing)}",
             )
+        selected_paths = [Path(_with_path(batch_id, found[name])["path"]) for name in filenames]
     else:
-        selected_paths = list(available.values())
+        selected_paths = list_step_paths(batch_id, step)
     if not selected_paths:
         raise HTTPException(
             status_code=404,
@@ -104,12 +348,12 @@ def load_step_items(
     for path in selected_paths:
         item: Dict[str, Any] = {"filename": path.name, "path": str(path)}
         if include_bytes:
-            item["bytes"] = path.read_bytes()
+            item["bytes"] = _read_step_bytes(batch_id, step, path)
         items.append(item)
     return items
 
-def save_original_uploads(
-    uploads: Sequence[tuple[str, bytes]],
+async def save_original_uploads(
+    uploads: Sequence[tuple[str, Source]],
     *,
     batch_id: Optional[str] = None,
     step: str = "input",
@@ -117,36 +361,168 @@ def save_original_uploads(
     if not uploads:
         raise HTTPException(status_code=400, detail="No files to save")
     ensure_step(step)
-    bid = batch_id or new_batch_id()
-    saved = []
-    for name, raw in uploads:
+    for name, _ in uploads:
         validate_ext(name)
-        png_bytes = to_png_rgba_bytes(raw)
-        out_name = f"{Path(name).stem}_{short_uid()}.png"
-        saved.append(
-            {
-                "original_filename": name,
-                "stored_filename": out_name,
-                "saved_path": save_step_png(bid, step, out_name, png_bytes),
-            }
+    # Reject undersized or unreadable files from their headers before any
+    # conversion starts, so a bad file never leaves a half-saved batch.
+    ready = await asyncio.gather(
+        *(asyncio.to_thread(probe_upload, name, source) for name, source in uploads)
+    )
+    bid = batch_id or new_batch_id()
+    window = asyncio.Semaphore(ITEM_WINDOW)
+
+    async def convert_one(name: str, source: Source, passthrough: bool) -> dict:
+        # RGBA PNGs are stored as uploaded; everything else is converted on the
+        # process pool. Each result is stored as soon as it is ready.
+        async with window:
+            if passthrough:
+                png_bytes = await asyncio.to_thread(verified_png_bytes, source)
+            else:
+                png_bytes = await run_cpu(to_png_rgba_bytes, source, step, interactive=len(uploads) == 1)
+            out_name = f"{Path(name).stem}_{short_uid()}.png"
+            saved_path = save_step_png(bid, step, out_name, png_bytes, source=lineage(None, name))
+        return {
+            "original_filename": name,
+            "stored_filename": out_name,
+            "saved_path": saved_path,
+        }
+
+    saved = list(
+        await asyncio.gather(
+            *(convert_one(name, source, passthrough) for (name, source), passthrough in zip(uploads, ready))
         )
+    )
     return {"batch_id": bid, "count": len(saved), "items": saved}
 
+class UploadSpool:
+    """
+    Streams request uploads to a private temp directory in chunks, enforcing
+    per-file and per-request size limits, so payloads never sit in memory as a
+    whole. close() removes the files unless hand_off() gave them to a job.
+    """
+
+    def __init__(
+        self,
+        max_file_bytes: int = MAX_UPLOAD_BYTES,
+        max_total_bytes: int = MAX_REQUEST_UPLOAD_BYTES,
+    ):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+        self._dir: Optional[Path] = None
+        self._handed_off = False
+
+    async def add(self, upload: UploadFile) -> Path:
+        if self._dir is None:
+            self._dir = Path(tempfile.mkdtemp(prefix="uploads-"))
+        path = self._dir / f"{short_uid()}_{Path(upload.filename or 'upload').name}"
+        size = 0
+        # File I/O runs on a thread so large uploads do not stall the event loop.
+        out = await asyncio.to_thread(open, path, "wb")
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                self.total_bytes += len(chunk)
+                if size > self.max_file_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"'{upload.filename}' exceeds the {self.max_file_bytes} byte upload limit.",
+                    )
+                if self.total_bytes > self.max_total_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request exceeds the {self.max_total_bytes} byte upload limit.",
+                    )
+                await asyncio.to_thread(out.write, chunk)
+        finally:
+            await asyncio.to_thread(out.close)
+        await upload.close()
+        if not size:
+            raise HTTPException(status_code=400, detail=f"Uploaded file '{upload.filename}' is empty.")
+        return path
+
+    def hand_off(self, runner: Callable[[Any], Awaitable[Any]]) -> Callable[[Any], Awaitable[Any]]:
+        """Wrap a job runner so the spooled files live until the job finishes."""
+        self._handed_off = True
+
+        async def run(job):
+            try:
+                return await runner(job)
+            finally:
+                self._cleanup()
+
+        return run
+
+    def close(self) -> None:
+        if not self._handed_off:
+            self._cleanup()
+
+    def _cleanup(self) -> None:
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
 def allowed_step_regex() -> str:
     """Helper for FastAPI Query pattern."""
     return f"^({'|'.join(STEPS)})$"
 
+class _ZipSink(io.RawIOBase):
+    """Non-seekable write target; zipfile falls back to data descriptors for it."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+@instrumented("zip")
+def iter_zip(entries: Iterable[Tuple[str, Union[Path, bytes]]]) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive chunk by chunk. Entries are (arcname, path-or-bytes) and
+    are read lazily, so memory stays flat regardless of how many files go in.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for arcname, source in entries:
+            if isinstance(source, (bytes, bytearray)):
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.file_size = len(source)
+            else:
+                info = zipfile.ZipInfo.from_file(source, arcname=arcname)
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if Path(arcname).suffix.lower() in ZIP_STORED_EXT
+                else zipfile.ZIP_DEFLATED
+            )
+            with zf.open(info, "w") as dest:
+                if isinstance(source, (bytes, bytearray)):
+                    dest.write(source)
+                else:
+                    with open(source, "rb") as f:
+                        while chunk := f.read(ZIP_CHUNK_SIZE):
+                            dest.write(chunk)
+                            yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+def zip_streaming_response(entries: Iterable[Tuple[str, Union[Path, bytes]]], filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        iter_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 def zip_paths_for_batch_step(batch_id: str, step: str) -> StreamingResponse:
     paths = list_step_paths(batch_id, step)
     if not paths:
         raise HTTPException(status_code=404, detail=f"No files for batch {batch_id} step {step}")
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for p in paths:
-            z.write(p, arcname=p.name)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={batch_id}-{step}.zip"}
-    )
+    return zip_streaming_response(((p.name, p) for p in paths), f"{batch_id}-{step}.zip")
@@ -0,0 +1,138 @@
+#job_service
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_S = float(os.getenv("JOB_TTL_S", str(24 * 3600)))
+
+class Job:
+    def __init__(self, kind: str, batch_id: str, step: str, filenames: List[str]):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.batch_id = batch_id
+        self.step = step
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.items: List[Dict[str, Any]] = [
+            {"filename": name, "status": "pending"} for name in filenames
+        ]
+
+    def finish_item(self, index: int, result: Dict[str, Any]) -> None:
+        entry = self.items[index]
+        entry.update(result)
+        entry["status"] = "done" if result.get("ok") else "failed"
+        self.updated_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def progress(self) -> dict:
+        counts = {"pending": 0, "done": 0, "failed": 0}
+        for item in self.items:
+            counts[item["status"]] += 1
+        total = len(self.items)
+        completed = counts["done"] + counts["failed"]
+        return {**counts, "total": total, "ratio": round(completed / total, 4) if total else 1.0}
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "batch_id": self.batch_id,
+            "step": self.step,
+            "status": self.status,
+            "error": self.error,
+            "progress": self.progress(),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "items": self.items,
+        }
+
+JobRunner = Callable[[Job], Awaitable[None]]
+
+class JobManager:
+    """
+    In-process job queue. Submitting returns immediately; a fixed number of
+    worker tasks run jobs in the background and each runner reports per-item
+    progress through Job.finish_item.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_workers(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self._queue
+
+    async def _worker(self) -> None:
+        while True:
+            job, runner = await self._queue.get()
+            job.status = "processing"
+            job.updated_at = time.time()
+            try:
+                await runner(job)
+                ok = any(item["status"] == "done" for item in job.items)
+                job.status = "done" if ok else "failed"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            finally:
+                job.updated_at = time.time()
+                self._queue.task_done()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_TTL_S
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.updated_at < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, kind: str, batch_id: str, step: str, filenames: List[str], runner: JobRunner) -> Job:
+        self._prune()
+        job = Job(kind, batch_id, step, filenames)
+        self._jobs[job.id] = job
+        self._ensure_workers().put_nowait((job, runner))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "jobs": len(self._jobs),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": sum(1 for j in self._jobs.values() if j.status == "processing"),
+        }
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+jobs = JobManager()
+
+def accepted_response(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "batch_id": job.batch_id,
+        "status": job.status,
+        "status_url": f"/process/{job.id}/status",
+        "results_url": f"/process/{job.id}/results",
+    }
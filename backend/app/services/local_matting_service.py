@@ -0,0 +1,119 @@
+#local_matting_service
+import io
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from .image_io_service import encode_for_step
+from .metrics_service import instrumented
+
+LOCAL_MATTING_ENABLED = os.getenv("LOCAL_MATTING", "1") != "0"
+# Cutouts below this score go to remove.bg instead.
+LOCAL_MATTING_MIN_CONFIDENCE = float(os.getenv("LOCAL_MATTING_MIN_CONFIDENCE", "0.9"))
+# Background detection runs on a thumbnail; only the edge band is refined at full size.
+ANALYSIS_MAX_SIDE = 320
+FEATHER_RADIUS = 0.8
+
+def _border_pixels(arr: np.ndarray) -> np.ndarray:
+    h, w = arr.shape[:2]
+    t = max(2, round(0.02 * min(h, w)))
+    return np.concatenate(
+        [
+            arr[:t].reshape(-1, 3),
+            arr[-t:].reshape(-1, 3),
+            arr[t:-t, :t].reshape(-1, 3),
+            arr[t:-t, -t:].reshape(-1, 3),
+        ]
+    )
+
+def _distance(pixels: np.ndarray, color: np.ndarray) -> np.ndarray:
+    diff = pixels.astype(np.float32) - color
+    return np.sqrt(np.einsum("...c,...c->...", diff, diff))
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    return grown
+
+def _flood_from_border(candidate: np.ndarray) -> np.ndarray:
+    """Keep only the candidate pixels 4-connected to the image border."""
+    region = np.zeros_like(candidate)
+    region[[0, -1], :] = candidate[[0, -1], :]
+    region[:, [0, -1]] = candidate[:, [0, -1]]
+    for _ in range(sum(candidate.shape)):
+        grown = _dilate(region) & candidate
+        if np.array_equal(grown, region):
+            break
+        region = grown
+    return region
+
+def analyze_background(rgb: Image.Image) -> Tuple[float, np.ndarray, float, np.ndarray]:
+    """
+    Score how confidently the image sits on a plain, near-uniform backdrop.
+    Returns (confidence, background colour, colour tolerance, background mask
+    at analysis size).
+    """
+    small = rgb.copy()
+    small.thumbnail((ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE), Image.BILINEAR)
+    arr = np.asarray(small)
+    border = _border_pixels(arr)
+    color = np.median(border, axis=0).astype(np.float32)
+    border_dist = _distance(border, color)
+    tol = float(np.clip(3.0 * np.median(border_dist) + 10.0, 12.0, 40.0))
+
+    dist = _distance(arr, color)
+    bg = _flood_from_border(dist < tol)
+    fg_fraction = 1.0 - float(bg.mean())
+    if not 0.02 <= fg_fraction <= 0.9:
+        return 0.0, color, tol, bg
+    # Subject pixels close to the backdrop colour make the edge ambiguous
+    # (white product on white sweep); those belong to remove.bg.
+    ambiguous = (~bg) & (dist < 2.0 * tol)
+    clean_border = float((border_dist < tol).mean())
+    clean_subject = 1.0 - float(ambiguous.sum()) / max(1, int((~bg).sum()))
+    return min(clean_border, clean_subject), color, tol, bg
+
+@instrumented("local_matting")
+def matte_plain_background(
+    image_bytes: bytes,
+    max_pixels: Optional[int] = None,
+    min_confidence: float = LOCAL_MATTING_MIN_CONFIDENCE,
+) -> Optional[bytes]:
+    """
+    Cut the subject out of a plain studio backdrop locally. Returns an RGBA
+    PNG, or None when the backdrop is not uniform enough to trust the result.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        if im.mode in ("RGBA", "LA", "PA") and im.getextrema()[-1][0] < 250:
+            return None  # already has transparency; leave it to remove.bg
+        rgb = im.convert("RGB")
+    # Match the remote engine, whose uploads have the orientation baked in.
+    ImageOps.exif_transpose(rgb, in_place=True)
+    if max_pixels and rgb.width * rgb.height > max_pixels:
+        scale = (max_pixels / (rgb.width * rgb.height)) ** 0.5
+        rgb = rgb.resize((max(1, int(rgb.width * scale)), max(1, int(rgb.height * scale))), Image.LANCZOS)
+
+    confidence, color, tol, bg = analyze_background(rgb)
+    if confidence < min_confidence:
+        return None
+
+    # The upscaled mask is exact away from the subject outline. Within one
+    # analysis pixel of it, alpha comes from each full-resolution pixel's
+    # distance to the backdrop colour instead.
+    def upscale(mask: np.ndarray) -> np.ndarray:
+        return np.asarray(Image.fromarray(mask.astype(np.uint8) * 255).resize(rgb.size, Image.NEAREST)) > 0
+
+    alpha = np.where(upscale(bg), 0, 255).astype(np.uint8)
+    band = upscale(_dilate(bg) & _dilate(~bg))
+    if band.any():
+        d = _distance(np.asarray(rgb)[band], color)
+        alpha[band] = np.clip((d - 0.5 * tol) / tol * 255.0, 0, 255).astype(np.uint8)
+    matte = Image.fromarray(alpha).filter(ImageFilter.GaussianBlur(FEATHER_RADIUS))
+    out = rgb.convert("RGBA")
+    out.putalpha(matte)
+    return encode_for_step(out, "remove_bg")
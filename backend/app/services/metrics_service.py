@@ -0,0 +1,285 @@
+#metrics_service
+import asyncio
+import bisect
+import functools
+import inspect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition without a client dependency. Every metric is a
+# dict of label tuples behind one lock, so recording is a few dict operations.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+class Gauge(_Metric):
+    """Settable with inc/dec, or read at scrape time from `fn` ({label tuple: value} or a number)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._fn = fn
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[str]:
+        if self._fn is not None:
+            value = self._fn()
+            items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum].
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram("http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route"))
+)
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge("http_requests_in_flight", "HTTP requests being served."))
+HTTP_BYTES = REGISTRY.register(
+    Counter("http_bytes_total", "HTTP body bytes by route and direction (in/out).", ("route", "direction"))
+)
+STAGE_LATENCY = REGISTRY.register(
+    Histogram("stage_duration_seconds", "Latency of one pipeline stage call.", ("stage",))
+)
+STAGE_ERRORS = REGISTRY.register(Counter("stage_errors_total", "Pipeline stage calls that raised.", ("stage",)))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge("stage_in_flight", "Pipeline stage calls in progress.", ("stage",)))
+UPSTREAM_REQUESTS = REGISTRY.register(
+    Counter("upstream_requests_total", "Upstream API responses by status code.", ("upstream", "status"))
+)
+UPSTREAM_RETRIES = REGISTRY.register(
+    Counter("upstream_retries_total", "Upstream attempts repeated after a failure.", ("upstream", "reason"))
+)
+UPSTREAM_BYTES = REGISTRY.register(
+    Counter("upstream_bytes_total", "Upstream payload bytes by direction (sent/received).", ("upstream", "direction"))
+)
+
+def instrumented(stage: str) -> Callable[[Callable], Callable]:
+    """
+    Record latency, errors and in-flight count of every call under `stage`.
+    Works on plain, async and generator functions without changing their
+    signature. Calls made on the process pool are timed by run_cpu instead,
+    which reads the stage from `__stage__`.
+    """
+
+    def decorate(fn: Callable) -> Callable:
+        def start() -> float:
+            STAGE_IN_FLIGHT.inc(stage=stage)
+            return time.perf_counter()
+
+        def finish(began: float, failed: bool) -> None:
+            STAGE_IN_FLIGHT.dec(stage=stage)
+            STAGE_LATENCY.observe(time.perf_counter() - began, stage=stage)
+            if failed:
+                STAGE_ERRORS.inc(stage=stage)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                began, failed = start(), True
+                try:
+                    result = await fn(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    finish(began, failed)
+        elif inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                began, failed = start(), True
+                try:
+                    yield from fn(*args, **kwargs)
+                    failed = False
+                finally:
+                    finish(began, failed)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                began, failed = start(), True
+                try:
+                    result = fn(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    finish(began, failed)
+
+        wrapper.__stage__ = stage
+        return wrapper
+
+    return decorate
+
+def observe_stage(stage: str, seconds: float, *, failed: bool = False) -> None:
+    STAGE_LATENCY.observe(seconds, stage=stage)
+    if failed:
+        STAGE_ERRORS.inc(stage=stage)
+
+def record_upstream(upstream: str, status, *, sent: int = 0, received: int = 0) -> None:
+    UPSTREAM_REQUESTS.inc(upstream=upstream, status=status)
+    if sent:
+        UPSTREAM_BYTES.inc(sent, upstream=upstream, direction="sent")
+    if received:
+        UPSTREAM_BYTES.inc(received, upstream=upstream, direction="received")
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware), so streaming responses pass
+    straight through. Routes are labelled by their template, e.g.
+    /io/batches/{batch_id}/list; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        began = time.perf_counter()
+        status = 500
+        bytes_in = 0
+        bytes_out = 0
+
+        async def counting_receive():
+            nonlocal bytes_in
+            message = await receive()
+            if message["type"] == "http.request":
+                bytes_in += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, bytes_out
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                bytes_out += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            HTTP_LATENCY.observe(time.perf_counter() - began, method=method, route=route)
+            if bytes_in:
+                HTTP_BYTES.inc(bytes_in, route=route, direction="in")
+            if bytes_out:
+                HTTP_BYTES.inc(bytes_out, route=route, direction="out")
@@ -2,10 +2,36 @@
 import os
 import io
 import asyncio
-from typing import Optional, Literal
+import math
+import time
+import zipfile
+from typing import Optional, Literal, Callable, Awaitable, NamedTuple
+import numpy as np
 import httpx
 from PIL import Image, ImageOps, ImageFilter
 
+from .cache_service import DiskLRUCache, content_key
+from .metrics_service import instrumented, observe_stage, record_upstream, STAGE_IN_FLIGHT, UPSTREAM_RETRIES
+from .http_client_service import get_client
+from .executor_service import run_cpu
+from .local_matting_service import LOCAL_MATTING_ENABLED, matte_plain_background
+from .upstream_limiter_service import get_limiter, retry_after_seconds
+from .image_io_service import Source, load_source, encode_for_step, group_duplicates
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("REMOVE_BG_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Output resolution caps for remove.bg's `size` parameter; "auto" is the highest available.
+SIZE_MAX_PIXELS = {
+    "auto": 25_000_000,
+    "preview": 250_000,
+    "small": 250_000,
+    "regular": 250_000,
+    "medium": 1_500_000,
+    "hd": 4_000_000,
+    "4k": 10_000_000,
+    "full": 25_000_000,
+    "50MP": 50_000_000,
+}
+
 def _infer_mime_from_name(name: str | None) -> str:
     if not name:
         return "application/octet-stream"
@@ -18,6 +44,99 @@ def _infer_mime_from_name(name: str | None) -> str:
         return "image/webp"
     return "application/octet-stream"
 
+UPLOAD_JPEG_QUALITY = int(os.getenv("REMOVE_BG_UPLOAD_JPEG_QUALITY", "92"))
+# Fetch plain PNG cutouts as remove.bg's zip (JPEG colour + PNG alpha), which is
+# much smaller on the wire, and merge it locally.
+ZIP_TRANSFER = os.getenv("REMOVE_BG_ZIP_TRANSFER", "1") != "0"
+
+class Cutout(NamedTuple):
+    content: bytes
+    engine: str
+    mask: Optional[bytes] = None
+
+def _has_alpha(im: Image.Image) -> bool:
+    if im.mode in ("RGBA", "LA", "PA"):
+        return im.getchannel("A").getextrema()[0] < 255
+    return "transparency" in im.info
+
+@instrumented("upload_prepare")
+def _prepare_upload(image_bytes: bytes, max_pixels: Optional[int]) -> Optional[tuple[bytes, str]]:
+    """
+    Shrink an upload to what the requested remove.bg size can use and send
+    opaque images as high-quality JPEG. Returns (bytes, mime), or None when
+    the original is already the smallest sensible upload.
+    """
+    try:
+        im = Image.open(io.BytesIO(image_bytes))
+    except Exception:
+        return None  # send it as-is and let remove.bg report the unreadable file
+    with im:
+        w, h = im.size
+        too_big = bool(max_pixels) and w * h > max_pixels
+        if not too_big and im.format == "JPEG":
+            return None
+        if too_big:
+            scale = math.sqrt(max_pixels / (w * h))
+            target = (max(1, int(w * scale)), max(1, int(h * scale)))
+            im.draft("RGB", target)
+        opaque = not _has_alpha(im)
+        img = im.convert("RGB" if opaque else "RGBA")
+    if too_big:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+    # The re-encoded upload carries no EXIF, so bake the orientation in.
+    ImageOps.exif_transpose(img, in_place=True)
+    out = io.BytesIO()
+    if opaque:
+        img.save(out, format="JPEG", quality=UPLOAD_JPEG_QUALITY)
+        mime = "image/jpeg"
+    else:
+        img.save(out, format="PNG", compress_level=1)
+        mime = "image/png"
+    if not too_big and out.tell() >= len(image_bytes):
+        return None
+    return out.getvalue(), mime
+
+@instrumented("zip_merge")
+def _merge_zip_result(zip_bytes: bytes) -> tuple[bytes, Optional[bytes]]:
+    """Unpack a remove.bg zip in memory; returns (RGBA PNG, alpha mask PNG)."""
+    if not zipfile.is_zipfile(io.BytesIO(zip_bytes)):
+        return zip_bytes, None  # upstream answered with a finished image instead
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        names = zf.namelist()
+        color_name = next((n for n in names if n.lower().endswith((".jpg", ".jpeg"))), None)
+        alpha_name = next((n for n in names if n.lower().endswith(".png")), None)
+        if color_name is None or alpha_name is None:
+            raise RemoveBGError(200, {"error": "zip result lacks a JPEG colour or PNG alpha entry", "entries": names})
+        color_bytes = zf.read(color_name)
+        mask_bytes = zf.read(alpha_name)
+    with Image.open(io.BytesIO(color_bytes)) as color, Image.open(io.BytesIO(mask_bytes)) as alpha:
+        rgb = np.asarray(color.convert("RGB"))
+        a = alpha.convert("L")
+        if a.size != color.size:
+            a = a.resize(color.size, Image.LANCZOS)
+        rgba = np.dstack((rgb, np.asarray(a)))
+    return encode_for_step(Image.fromarray(rgba, "RGBA"), "remove_bg"), mask_bytes
+
+@instrumented("restore_full_resolution")
+def _restore_full_resolution(
+    original_bytes: bytes, cutout_bytes: bytes, mask_bytes: Optional[bytes] = None
+) -> tuple[bytes, Optional[bytes]]:
+    """Upscale a smaller cutout's alpha onto the original pixels; returns (RGBA PNG, mask PNG)."""
+    with Image.open(io.BytesIO(original_bytes)) as src, Image.open(io.BytesIO(cutout_bytes)) as cut:
+        # Cutouts come back upright; match the original's EXIF orientation.
+        ImageOps.exif_transpose(src, in_place=True)
+        if cut.size == src.size:
+            return cutout_bytes, mask_bytes
+        if mask_bytes:
+            with Image.open(io.BytesIO(mask_bytes)) as m:
+                alpha = m.convert("L").resize(src.size, Image.LANCZOS)
+        else:
+            alpha = cut.convert("RGBA").getchannel("A").resize(src.size, Image.LANCZOS)
+        out = src.convert("RGB").convert("RGBA")
+    out.putalpha(alpha)
+    return encode_for_step(out, "remove_bg"), encode_for_step(alpha, "remove_bg")
+
+@instrumented("preprocess_retry")
 def _preprocess(image_bytes: bytes) -> bytes:
     b = io.BytesIO(image_bytes)
     im = Image.open(b).convert("RGB")
@@ -38,6 +157,10 @@ class RemoveBGError(RuntimeError):
         self.payload = payload
         super().__init__(f"remove.bg error {status}: {payload}")
 
+    def __reduce__(self):
+        # Raised in pool workers too; rebuild from both fields when unpickled.
+        return type(self), (self.status, self.payload)
+
 class RemoveBGService:
     def __init__(self, api_key: str | None = None, *, timeout_s: float = 60.0):
         self.api_key = api_key or os.getenv("REMOVE_BG_API_KEY") or os.getenv("REMOVEBG_API_KEY")
@@ -45,7 +168,20 @@ class RemoveBGService:
             raise RuntimeError("REMOVE_BG_API_KEY (or REMOVEBG_API_KEY) missing")
         self.url = "https://api.remove.bg/v1.0/removebg"
         self._timeout = httpx.Timeout(timeout_s)
-        self._limits = httpx.Limits(max_keepalive_connections=10, max_connections=20)
+        self.cache = DiskLRUCache("remove_bg", RESULT_CACHE_MAX_BYTES)
+        self.local_count = 0
+        self.remote_count = 0
+        self.upload_bytes_original = 0
+        self.upload_bytes_sent = 0
+        self.duplicates_skipped = 0
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "engines": {"local": self.local_count, "remove_bg": self.remote_count},
+            "upload_bytes": {"original": self.upload_bytes_original, "sent": self.upload_bytes_sent},
+            "duplicates_skipped": self.duplicates_skipped,
+        }
 
     def _headers(self) -> dict:
         return {"X-Api-Key": self.api_key}
@@ -54,23 +190,68 @@ class RemoveBGService:
     def _retryable(status: int) -> bool:
         return status in (408, 409, 425, 429, 500, 502, 503, 504)
 
-    async def _post(self, client: httpx.AsyncClient, data: dict, files: dict, *, max_retries: int = 2) -> httpx.Response:
+    async def _send(self, client: httpx.AsyncClient, data: dict, files: dict) -> httpx.Response:
+        """One remove.bg request, timed as remove_bg_call without limiter waits or retry backoff."""
+        STAGE_IN_FLIGHT.inc(stage="remove_bg_call")
+        began = time.perf_counter()
+        r = None
+        try:
+            r = await client.post(self.url, headers=self._headers(), data=data, files=files, timeout=self._timeout)
+            return r
+        finally:
+            STAGE_IN_FLIGHT.dec(stage="remove_bg_call")
+            observe_stage("remove_bg_call", time.perf_counter() - began, failed=r is None or r.status_code != 200)
+
+    async def _post(
+        self,
+        client: httpx.AsyncClient,
+        data: dict,
+        files: dict,
+        *,
+        max_retries: int = 2,
+        max_throttled: int = 6,
+        interactive: bool = False,
+        batch_id: Optional[str] = None,
+    ) -> httpx.Response:
+        # Every attempt takes a slot from the shared adaptive limiter; 429s shrink
+        # it and pause all callers, so they are retried without extra backoff.
+        limiter = get_limiter("remove_bg")
+        sent_bytes = sum(len(part[1]) for part in files.values())
         attempt = 0
+        throttled = 0
         while True:
+            await limiter.acquire(interactive=interactive, key=batch_id)
             try:
-                r = await client.post(self.url, headers=self._headers(), data=data, files=files)
+                r = await self._send(client, data, files)
             except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                limiter.release("error")
+                record_upstream("remove_bg", "timeout")
                 if attempt >= max_retries:
                     raise RemoveBGError(-1, f"{e!r}")
+                UPSTREAM_RETRIES.inc(upstream="remove_bg", reason="timeout")
                 await asyncio.sleep(0.8 * (2 ** attempt))
                 attempt += 1
                 continue
+            except BaseException:
+                limiter.release("error")
+                raise
+            record_upstream("remove_bg", r.status_code, sent=sent_bytes, received=len(r.content))
             if r.status_code == 200:
+                limiter.release("ok", r.headers)
                 return r
-            if self._retryable(r.status_code) and attempt < max_retries:
-                await asyncio.sleep(0.8 * (2 ** attempt))
-                attempt += 1
-                continue
+            if r.status_code == 429:
+                limiter.release("throttled", r.headers)
+                if throttled < max_throttled:
+                    UPSTREAM_RETRIES.inc(upstream="remove_bg", reason="throttled")
+                    throttled += 1
+                    continue
+            else:
+                limiter.release("error", r.headers)
+                if self._retryable(r.status_code) and attempt < max_retries:
+                    UPSTREAM_RETRIES.inc(upstream="remove_bg", reason=str(r.status_code))
+                    await asyncio.sleep(retry_after_seconds(r.headers.get("retry-after")) or 0.8 * (2 ** attempt))
+                    attempt += 1
+                    continue
             try:
                 payload = r.json()
             except Exception:
@@ -86,6 +267,118 @@ class RemoveBGService:
         format: Literal["png", "jpg", "zip"] = "png",
         bg_color: Optional[str] = None,
         bg_image_url: Optional[str] = None,
+        interactive: bool = False,
+        batch_id: Optional[str] = None,
+        full_resolution: bool = False,
+    ) -> bytes:
+        cut = await self.cutout(
+            image_bytes,
+            size=size,
+            filename_hint=filename_hint,
+            format=format,
+            bg_color=bg_color,
+            bg_image_url=bg_image_url,
+            interactive=interactive,
+            batch_id=batch_id,
+            full_resolution=full_resolution,
+        )
+        return cut.content
+
+    async def cutout(
+        self,
+        image_bytes: bytes,
+        size: str = "auto",
+        *,
+        filename_hint: str | None = None,
+        format: Literal["png", "jpg", "zip"] = "png",
+        bg_color: Optional[str] = None,
+        bg_image_url: Optional[str] = None,
+        interactive: bool = False,
+        batch_id: Optional[str] = None,
+        full_resolution: bool = False,
+    ) -> Cutout:
+        """
+        Like remove_background, but also reports the engine ("local" or
+        "remove_bg") and, when remove.bg sent one, the alpha mask as a PNG.
+        `interactive` and `batch_id` pick the upstream scheduling lane. With
+        `full_resolution`, a cutout returned smaller than the input (because of
+        `size`) has its mask upscaled back onto the original pixels.
+        """
+        plain = format == "png" and not bg_color and not bg_image_url
+        wire_format = "zip" if plain and ZIP_TRANSFER else format
+        content, engine = await self._cutout_at_size(
+            image_bytes,
+            size=size,
+            filename_hint=filename_hint,
+            format=wire_format,
+            bg_color=bg_color,
+            bg_image_url=bg_image_url,
+            interactive=interactive,
+            batch_id=batch_id,
+            allow_local=plain,
+        )
+        mask = None
+        if wire_format == "zip" and engine == "remove_bg" and format != "zip":
+            content, mask = await run_cpu(_merge_zip_result, content, interactive=interactive)
+        if full_resolution and plain:
+            content, mask = await run_cpu(
+                _restore_full_resolution, image_bytes, content, mask, interactive=interactive
+            )
+        return Cutout(content, engine, mask)
+
+    async def _cutout_at_size(
+        self,
+        image_bytes: bytes,
+        *,
+        size: str,
+        filename_hint: str | None,
+        format: str,
+        bg_color: Optional[str],
+        bg_image_url: Optional[str],
+        interactive: bool,
+        batch_id: Optional[str],
+        allow_local: bool,
+    ) -> tuple[bytes, str]:
+        cache_key = content_key(
+            image_bytes, size=size, format=format, bg_color=bg_color, bg_image_url=bg_image_url
+        )
+        cached = await asyncio.to_thread(self.cache.get, cache_key)
+        if cached is not None:
+            return cached, "remove_bg"
+        # Plain studio backdrops are matted locally; remove.bg handles everything
+        # the local engine is not confident about.
+        if LOCAL_MATTING_ENABLED and allow_local:
+            local = await run_cpu(
+                matte_plain_background, image_bytes, SIZE_MAX_PIXELS.get(size), interactive=interactive
+            )
+            if local is not None:
+                self.local_count += 1
+                return local, "local"
+        result = await self._remove_background_remote(
+            image_bytes,
+            size=size,
+            filename_hint=filename_hint,
+            format=format,
+            bg_color=bg_color,
+            bg_image_url=bg_image_url,
+            interactive=interactive,
+            batch_id=batch_id,
+        )
+        await asyncio.to_thread(self.cache.set, cache_key, result)
+        self.remote_count += 1
+        return result, "remove_bg"
+
+    async def _remove_background_remote(
+        self,
+        image_bytes: bytes,
+        *,
+        size: str,
+        filename_hint: str | None,
+        format: str,
+        bg_color: Optional[str],
+        bg_image_url: Optional[str],
+        interactive: bool = False,
+        batch_id: Optional[str] = None,
     ) -> bytes:
         data: dict = {"size": size, "format": format}
         if bg_color:
@@ -94,41 +387,74 @@ class RemoveBGService:
             data["bg_image_url"] = bg_image_url
         mime = _infer_mime_from_name(filename_hint)
         files = {"image_file": (filename_hint or "image", image_bytes, mime)}
-        async with httpx.AsyncClient(timeout=self._timeout, limits=self._limits) as client:
-            try:
-                r = await self._post(client, data=data, files=files)
-                return r.content
-            except RemoveBGError as e:
-                if isinstance(e.payload, dict) and any(err.get("code") == "unknown_foreground" for err in e.payload.get("errors", [])):
-                    pp = _preprocess(image_bytes)
-                    files2 = {"image_file": ("preprocessed.jpg", pp, "image/jpeg")}
-                    r2 = await self._post(client, data=data, files=files2)
-                    return r2.content
-                raise e
+        prepared = await run_cpu(_prepare_upload, image_bytes, SIZE_MAX_PIXELS.get(size), interactive=interactive)
+        if prepared is not None:
+            upload, mime = prepared
+            files = {"image_file": ("image.jpg" if mime == "image/jpeg" else "image.png", upload, mime)}
+        self.upload_bytes_original += len(image_bytes)
+        self.upload_bytes_sent += len(files["image_file"][1])
+        client = get_client("remove_bg")
+        try:
+            r = await self._post(client, data=data, files=files, interactive=interactive, batch_id=batch_id)
+            return r.content
+        except RemoveBGError as e:
+            if isinstance(e.payload, dict) and any(err.get("code") == "unknown_foreground" for err in e.payload.get("errors", [])):
+                pp = await run_cpu(_preprocess, image_bytes, interactive=interactive)
+                files2 = {"image_file": ("preprocessed.jpg", pp, "image/jpeg")}
+                r2 = await self._post(client, data=data, files=files2, interactive=interactive, batch_id=batch_id)
+                return r2.content
+            raise e
 
     async def batch_remove_background(
         self,
-        items: list[tuple[str, bytes]],
+        items: list[tuple[str, Source]],
         size: str = "auto",
         concurrent: int = 3,
         *,
         format: Literal["png", "jpg", "zip"] = "png",
         bg_color: Optional[str] = None,
         bg_image_url: Optional[str] = None,
+        on_result: Optional[Callable[[int, dict], Awaitable[None]]] = None,
+        interactive: bool = False,
+        batch_id: Optional[str] = None,
+        full_resolution: bool = False,
     ) -> list[dict]:
+        """
+        Identical payloads are processed once: the result is fanned out to every
+        copy, and copies carry "duplicate_of" with the filename that was sent.
+        """
         sem = asyncio.Semaphore(max(1, min(concurrent, 16)))
-        async def process_one(name: str, data: bytes):
+        results: list[dict] = [{} for _ in items]
+
+        async def process_group(indices: list[int]):
+            name, source = items[indices[0]]
             async with sem:
                 try:
-                    out_png = await self.remove_background(
-                        data,
+                    # Payloads are read only once a slot is free, so at most
+                    # `concurrent` of them are in memory at a time.
+                    cut = await self.cutout(
+                        await asyncio.to_thread(load_source, source),
                         size=size,
                         filename_hint=name,
                         format=format,
                         bg_color=bg_color,
                         bg_image_url=bg_image_url,
+                        interactive=interactive,
+                        batch_id=batch_id,
+                        full_resolution=full_resolution,
                     )
-                    return {"filename": name, "ok": True, "content": out_png}
+                    outcome = {"ok": True, "content": cut.content, "engine": cut.engine, "mask": cut.mask}
                 except Exception as e:
-                    return {"filename": name, "ok": False, "error": str(e)}
-        return await asyncio.gather(*(process_one(n, d) for n, d in items))
+                    outcome = {"ok": False, "error": str(e)}
+            for index in indices:
+                result = {"filename": items[index][0], **outcome}
+                if index != indices[0]:
+                    result["duplicate_of"] = name
+                results[index] = result
+                if on_result:
+                    await on_result(index, result)
+
+        groups = await group_duplicates([source for _, source in items])
+        self.duplicates_skipped += len(items) - len(groups)
+        await asyncio.gather(*(process_group(indices) for indices in groups))
+        return results
@@ -1,17 +1,49 @@
+import asyncio
 import io
+import os
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 
-import requests
+import numpy as np
 from PIL import Image, ImageFilter
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
+
+from .http_client_service import get_client
+from .executor_service import run_cpu
+from .cache_service import DiskLRUCache, MemoryLRUCache, content_key
+from .image_io_service import encode_for_step
+from .upstream_limiter_service import get_limiter
+from .metrics_service import instrumented, record_upstream
+
+DALLE_MODEL = "dall-e-3"
+DALLE_SIZE = "1024x1024"
+BACKGROUND_CACHE_MAX_BYTES = int(os.getenv("DALLE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SHADOW_RADIUS = 25
+SHADOW_OPACITY = 120
+SHADOW_OFFSET_RATIO = 0.02
+SHADOW_DOWNSCALE = int(os.getenv("SHADOW_DOWNSCALE", "4"))
+# Per-process cache of decoded, resized backgrounds; with the process pool each
+# worker keeps its own, so it also carries across requests.
+DECODED_BACKGROUND_CACHE_MAX_BYTES = int(os.getenv("DECODED_BACKGROUND_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+_decoded_backgrounds = MemoryLRUCache(
+    "decoded_backgrounds",
+    DECODED_BACKGROUND_CACHE_MAX_BYTES,
+    sizeof=lambda img: img.width * img.height * 4,
+)
+_SHADOW_LUT = [(v * SHADOW_OPACITY + 127) // 255 for v in range(256)]
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
 
 
 class Text2ImageService:
     OUTPUT_DIR = Path(__file__).resolve().parents[1] / "outputs"
 
     def __init__(self):
-        self.client = OpenAI()
+        self.client = AsyncOpenAI()
+        self.background_cache = DiskLRUCache("dalle_backgrounds", BACKGROUND_CACHE_MAX_BYTES)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
 
     def build_prompt(self, base_prompt: str, option: int) -> str:
         base_prompt = base_prompt.strip()
@@ -27,40 +59,98 @@ class Text2ImageService:
             raise ValueError("Invalid option: must be 1–4")
         return f"{base_prompt}. {extra[option]}"
 
-    def _generate_dalle_background(self, prompt: str) -> bytes:
+    @instrumented("dalle_generate")
+    async def _generate_dalle_background(self, prompt: str, *, interactive: bool = False) -> bytes:
+        limiter = get_limiter("openai")
         try:
-            response = self.client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                n=1,
-                size="1024x1024",
-            )
+            await limiter.acquire(interactive=interactive)
+            try:
+                response = await self.client.images.generate(
+                    model=DALLE_MODEL,
+                    prompt=prompt,
+                    n=1,
+                    size=DALLE_SIZE,
+                )
+            except RateLimitError as e:
+                limiter.release("throttled", e.response.headers)
+                record_upstream("openai", 429)
+                raise
+            except BaseException as e:
+                limiter.release("error")
+                if isinstance(e, Exception):
+                    record_upstream("openai", getattr(e, "status_code", None) or "error")
+                raise
+            limiter.release("ok")
+            record_upstream("openai", 200)
             image_url = response.data[0].url
-            image_data = requests.get(image_url, timeout=60).content
-            return image_data
+            r = await get_client("openai_download").get(image_url)
+            record_upstream("openai_download", r.status_code, received=len(r.content))
+            r.raise_for_status()
+            return r.content
         except Exception as e:
             raise RuntimeError(f"Background generation failed: {e}")
 
-    def _solid_background(self, size: Tuple[int, int], color=(255, 255, 255)) -> bytes:
+    @classmethod
+    def _solid_background(cls, size: Tuple[int, int], color=(255, 255, 255)) -> bytes:
         img = Image.new("RGBA", size, (*color, 255))
-        return self._image_to_bytes(img)
+        return cls._image_to_bytes(img)
+
+    async def _cached_dalle_background(self, prompt: str, option: int, *, interactive: bool = False) -> bytes:
+        """
+        Serve repeat scenes from the cache; concurrent misses for the same key
+        share one generation task instead of each calling DALL-E.
+        """
+        dalle_prompt = self.build_prompt(prompt, option)
+        key = content_key(
+            normalize_prompt(prompt).encode(), option=option, model=DALLE_MODEL, size=DALLE_SIZE
+        )
+        cached = await asyncio.to_thread(self.background_cache.get, key)
+        if cached is not None:
+            return cached
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate_and_store(key, dalle_prompt, interactive=interactive))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # Shielded so one client disconnecting does not cancel the shared generation.
+        return await asyncio.shield(task)
+
+    async def _generate_and_store(self, key: str, dalle_prompt: str, *, interactive: bool = False) -> bytes:
+        try:
+            data = await self._generate_dalle_background(dalle_prompt, interactive=interactive)
+            await asyncio.to_thread(self.background_cache.set, key, data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    def background_cache_stats(self) -> dict:
+        return {
+            **self.background_cache.stats(),
+            "in_flight": len(self._inflight),
+            "coalesced": self.coalesced,
+        }
 
-    def prepare_background(self, prompt: str, option: int, size: Tuple[int, int]) -> Optional[bytes]:
+    async def prepare_background(
+        self, prompt: str, option: int, size: Tuple[int, int], *, interactive: bool = False
+    ) -> Optional[bytes]:
         if option in (1, 2):
-            dalle_prompt = self.build_prompt(prompt, option)
-            return self._generate_dalle_background(dalle_prompt)
+            return await self._cached_dalle_background(prompt, option, interactive=interactive)
         if option == 3:
-            return self._solid_background(size, color=(255, 255, 255))
+            return await run_cpu(self._solid_background, size, (255, 255, 255), interactive=True)
         # option 4 skips background replacement
         return None
 
+    @classmethod
+    @instrumented("composite")
     def composite_images(
-        self,
+        cls,
         foreground_bytes: bytes,
         option: int,
         *,
         mask_bytes: Optional[bytes] = None,
         background_bytes: Optional[bytes] = None,
+        background_key: Optional[str] = None,
     ) -> bytes:
         foreground = Image.open(io.BytesIO(foreground_bytes)).convert("RGBA")
         mask = (
@@ -72,8 +162,7 @@ class Text2ImageService:
             mask = mask.resize(foreground.size, Image.LANCZOS)
 
         if background_bytes:
-            background = Image.open(io.BytesIO(background_bytes)).convert("RGBA")
-            background = background.resize(foreground.size, Image.LANCZOS)
+            background = cls._background_for(background_bytes, foreground.size, background_key)
         elif option == 4:
             # Skip background replacement: return the original transparent PNG
             return foreground_bytes
@@ -81,22 +170,77 @@ class Text2ImageService:
             background = Image.new("RGBA", foreground.size, (255, 255, 255, 255))
 
         if option in (1, 3):
-            background = self._apply_shadow(background, mask)
-
-        composite = background.copy()
+            composite = cls._apply_shadow(background, mask)
+        else:
+            composite = background.copy()
         composite.paste(foreground, mask=mask)
-        return self._image_to_bytes(composite)
+        return cls._image_to_bytes(composite)
+
+    @staticmethod
+    def _background_for(
+        background_bytes: bytes, size: Tuple[int, int], key: Optional[str] = None
+    ) -> Image.Image:
+        """
+        Decoded background resized to `size`, shared by every foreground of that
+        size. Callers must not mutate the returned image.
+        """
+        cache_key = (key or content_key(background_bytes), size)
+        background = _decoded_backgrounds.get(cache_key)
+        if background is None:
+            with Image.open(io.BytesIO(background_bytes)) as im:
+                background = im.convert("RGBA").resize(size, Image.LANCZOS)
+            _decoded_backgrounds.set(cache_key, background)
+        return background
 
-    def _apply_shadow(self, background: Image.Image, mask: Image.Image) -> Image.Image:
-        shadow = mask.copy().filter(ImageFilter.GaussianBlur(radius=25))
-        shadow_layer = Image.new("RGBA", background.size, (0, 0, 0, 0))
-        offset = (0, int(background.size[1] * 0.02))
-        shadow_layer.paste((0, 0, 0, 120), box=offset, mask=shadow)
-        return Image.alpha_composite(background, shadow_layer)
+    @staticmethod
+    def _shadow_mask(mask: Image.Image) -> Image.Image:
+        """
+        Shadow opacity (0..SHADOW_OPACITY) per pixel, already offset downwards.
+        A radius-25 blur carries no detail worth computing at full resolution,
+        so the mask is blurred at 1/SHADOW_DOWNSCALE size and upsampled.
+        """
+        w, h = mask.size
+        factor = max(1, min(SHADOW_DOWNSCALE, w // 64, h // 64))
+        small = mask.reduce(factor) if factor > 1 else mask
+        blurred = small.filter(ImageFilter.GaussianBlur(radius=SHADOW_RADIUS / factor)).point(_SHADOW_LUT)
+        dy = int(h * SHADOW_OFFSET_RATIO)
+        shadow = Image.new("L", (w, h), 0)
+        if h > dy:
+            # Upsample only the part that stays in frame after the offset.
+            visible = blurred.resize(
+                (w, h - dy),
+                Image.BILINEAR,
+                box=(0, 0, blurred.width, blurred.height * (h - dy) / h),
+            )
+            shadow.paste(visible, (0, dy))
+        return shadow
+
+    @classmethod
+    def _apply_shadow(cls, background: Image.Image, mask: Image.Image) -> Image.Image:
+        shadow = cls._shadow_mask(mask)
+        if background.getchannel("A").getextrema()[0] == 255:
+            # Over an opaque background, alpha-compositing a black layer reduces
+            # to pasting black through the shadow mask; no layer is materialized.
+            out = background.copy()
+            out.paste((0, 0, 0, 255), mask=shadow)
+            return out
+        return cls._alpha_composite_shadow(background, shadow)
+
+    @staticmethod
+    def _alpha_composite_shadow(background: Image.Image, shadow: Image.Image) -> Image.Image:
+        """Vectorized alpha_composite of a black layer with alpha `shadow` onto a translucent background."""
+        out = np.asarray(background, dtype=np.float32)
+        sa = np.asarray(shadow, dtype=np.float32) / 255.0
+        keep = 1.0 - sa
+        bg_a = out[..., 3] / 255.0
+        out_a = sa + bg_a * keep
+        scale = np.divide(bg_a * keep, out_a, out=np.zeros_like(out_a), where=out_a > 0)
+        out[..., :3] *= scale[..., None]
+        out[..., 3] = out_a * 255.0
+        out += 0.5
+        np.clip(out, 0, 255, out=out)
+        return Image.fromarray(out.astype(np.uint8), "RGBA")
 
     @staticmethod
     def _image_to_bytes(img: Image.Image) -> bytes:
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return buf.read()
+        return encode_for_step(img, "text2image")
@@ -0,0 +1,187 @@
+#upstream_limiter_service
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Hashable, Mapping, Optional
+
+# How long a 429 keeps the limit from being halved again, so one burst of
+# throttled responses counts as a single congestion signal.
+DECREASE_COOLDOWN_S = 1.0
+MAX_PAUSE_S = 120.0
+# Slots batch work may never take, so an interactive request finds one free
+# instead of waiting for a batch call to finish.
+INTERACTIVE_RESERVE = int(os.getenv("UPSTREAM_INTERACTIVE_RESERVE", "1"))
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveLimiter:
+    """
+    Process-wide AIMD concurrency limit for one upstream. Every success grows
+    the limit by 1/limit (about +1 per round of requests); a 429 halves it and
+    pauses all callers for Retry-After, or until the rate-limit window resets.
+
+    Waiters sit in two lanes: interactive callers are always served first and
+    may use the whole limit, batch callers are served round-robin per batch key
+    and leave `reserve` slots free.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        reserve: int = INTERACTIVE_RESERVE,
+    ):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self.reserve = max(0, reserve)
+        self._interactive: Deque[asyncio.Future] = deque()
+        self._batches: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _cap(self, interactive: bool) -> int:
+        limit = int(self.limit)
+        return limit if interactive else max(1, limit - self.reserve)
+
+    def _has_capacity(self, interactive: bool) -> bool:
+        return self.in_flight < self._cap(interactive) and time.monotonic() >= self._paused_until
+
+    async def acquire(self, *, interactive: bool = False, key: Hashable = None) -> None:
+        queued = self._interactive or (not interactive and self._batches)
+        if not queued and self._has_capacity(interactive):
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        lane = self._interactive if interactive else self._batches.setdefault(key, deque())
+        lane.append(fut)
+        self._wake()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.in_flight -= 1  # slot was handed over just as we were cancelled
+                self._wake()
+            else:
+                try:
+                    lane.remove(fut)
+                except ValueError:
+                    pass
+                if not interactive and not lane and self._batches.get(key) is lane:
+                    del self._batches[key]
+            raise
+
+    def release(self, outcome: str, headers: Optional[Mapping[str, str]] = None) -> None:
+        """outcome is "ok", "throttled" (429) or "error"; headers feed the rate-limit window."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if outcome == "ok":
+            self.successes += 1
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        elif outcome == "throttled":
+            self.throttled += 1
+            if now - self._last_decrease >= DECREASE_COOLDOWN_S:
+                self.limit = max(float(self.min_limit), self.limit / 2.0)
+                self._last_decrease = now
+        else:
+            self.errors += 1
+        if headers is not None:
+            self._observe(headers, throttled=outcome == "throttled")
+        self._wake()
+
+    def _observe(self, headers: Mapping[str, str], *, throttled: bool) -> None:
+        pause = retry_after_seconds(headers.get("retry-after"))
+        if pause is None and headers.get("x-ratelimit-remaining") == "0":
+            try:
+                pause = max(0.0, float(headers.get("x-ratelimit-reset", "")) - time.time())
+            except ValueError:
+                pause = None
+        if pause is None and throttled:
+            pause = 1.0
+        if pause:
+            self._paused_until = max(self._paused_until, time.monotonic() + min(pause, MAX_PAUSE_S))
+
+    def _wake(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            if (self._interactive or self._batches) and self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+            return
+        while self._interactive and self.in_flight < self._cap(True):
+            self._grant(self._interactive.popleft())
+        while self._batches and self.in_flight < self._cap(False):
+            # Round-robin: the batch just served goes to the back of the line.
+            key, lane = next(iter(self._batches.items()))
+            fut = lane.popleft()
+            if lane:
+                self._batches.move_to_end(key)
+            else:
+                del self._batches[key]
+            self._grant(fut)
+
+    def _grant(self, fut: asyncio.Future) -> None:
+        if not fut.done():
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "reserve": self.reserve,
+            "in_flight": self.in_flight,
+            "queued_interactive": len(self._interactive),
+            "queued_batch": sum(len(lane) for lane in self._batches.values()),
+            "batches_waiting": len(self._batches),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+LIMITERS: Dict[str, AdaptiveLimiter] = {
+    "remove_bg": AdaptiveLimiter(
+        "remove_bg",
+        initial=int(os.getenv("REMOVE_BG_CONCURRENCY_INITIAL", "4")),
+        min_limit=1,
+        max_limit=int(os.getenv("REMOVE_BG_CONCURRENCY_MAX", "20")),
+    ),
+    "openai": AdaptiveLimiter(
+        "openai",
+        initial=int(os.getenv("OPENAI_CONCURRENCY_INITIAL", "2")),
+        min_limit=1,
+        max_limit=int(os.getenv("OPENAI_CONCURRENCY_MAX", "5")),
+    ),
+}
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    return LIMITERS[name]
+
+def limiter_stats() -> Dict[str, dict]:
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
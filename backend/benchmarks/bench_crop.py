@@ -0,0 +1,69 @@
+"""
+Crop benchmark: full decode + crop + LANCZOS (the original path) against
+ImageCropService's reduced decode (JPEG draft / box reduce before resample).
+Reports render latency without the PNG encode both paths share, end-to-end
+process_one_png latency, and PSNR / max pixel difference (premultiplied for
+RGBA) of the reduced path against the full one.
+
+    cd backend && python -m benchmarks.bench_crop --megapixels 12,24
+"""
+import argparse
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from app.services.image_crop_service import ImageCropService
+from app.services.image_io_service import encode_for_step
+from benchmarks.common import best_of, make_photo
+
+def legacy_render(data: bytes, preset: str) -> Image.Image:
+    meta = ImageCropService.PRESETS[preset]
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    cropped = img.crop(ImageCropService._center_crop_box(img.size, meta["ratio"]))
+    return cropped.resize(meta["size"], Image.LANCZOS)
+
+def reduced_render(data: bytes, preset: str) -> Image.Image:
+    return ImageCropService._render(data, [preset])[preset]
+
+def _pixels(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert("RGBa") if img.mode == "RGBA" else img.convert("RGB"), dtype=np.float64)
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    mse = np.mean((_pixels(a) - _pixels(b)) ** 2)
+    return float("inf") if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+def max_diff(a: Image.Image, b: Image.Image) -> int:
+    return int(np.abs(_pixels(a) - _pixels(b)).max())
+
+def run(megapixels, repeat: int) -> None:
+    print(
+        f"{'input':>15} {'preset':>10} {'full ms':>9} {'reduced ms':>11} {'speedup':>8} "
+        f"{'e2e full':>9} {'e2e reduced':>12} {'PSNR dB':>8} {'max diff':>9}"
+    )
+    for mp in megapixels:
+        for fmt, mode in (("JPEG", "RGB"), ("PNG", "RGB"), ("PNG", "RGBA")):
+            data = make_photo(mp, fmt, mode)
+            for preset in ImageCropService.PRESETS:
+                full, reduced = legacy_render(data, preset), reduced_render(data, preset)
+                t_full = best_of(lambda: legacy_render(data, preset), repeat)
+                t_fast = best_of(lambda: reduced_render(data, preset), repeat)
+                e2e_full = best_of(lambda: encode_for_step(legacy_render(data, preset), "crop"), repeat)
+                e2e_fast = best_of(lambda: ImageCropService.process_one_png(data, "bench", preset), repeat)
+                print(
+                    f"{f'{mp:g}MP {mode} {fmt}':>15} {preset:>10} {t_full * 1000:>9.1f} {t_fast * 1000:>11.1f} "
+                    f"{t_full / t_fast:>7.2f}x {e2e_full * 1000:>9.1f} {e2e_fast * 1000:>12.1f} "
+                    f"{psnr(full, reduced):>8.1f} {max_diff(full, reduced):>9}"
+                )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", default="12,24", help="comma-separated input sizes in MP")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run([float(m) for m in args.megapixels.split(",")], args.repeat)
+
+if __name__ == "__main__":
+    main()
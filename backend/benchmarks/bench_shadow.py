@@ -0,0 +1,67 @@
+"""
+Shadow compositing benchmark: the original full-resolution blur + RGBA shadow
+layer + alpha_composite path against Text2ImageService's downscaled-blur path.
+
+    cd backend && python -m benchmarks.bench_shadow --sizes 1024,2000,3000
+"""
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.services.text2image_service import Text2ImageService
+from benchmarks.common import best_of
+
+def make_foreground(size: int) -> Image.Image:
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse(
+        (size * 0.25, size * 0.15, size * 0.75, size * 0.85),
+        fill=(180, 60, 40, 255),
+    )
+    return img
+
+def make_background(size: int) -> Image.Image:
+    ramp = np.linspace(40, 220, size, dtype=np.uint8)
+    rgb = np.dstack([np.tile(ramp, (size, 1))] * 3)
+    return Image.fromarray(rgb, "RGB").convert("RGBA")
+
+def legacy_composite(background: Image.Image, foreground: Image.Image, mask: Image.Image) -> Image.Image:
+    shadow = mask.copy().filter(ImageFilter.GaussianBlur(radius=25))
+    shadow_layer = Image.new("RGBA", background.size, (0, 0, 0, 0))
+    offset = (0, int(background.size[1] * 0.02))
+    shadow_layer.paste((0, 0, 0, 120), box=offset, mask=shadow)
+    composite = Image.alpha_composite(background, shadow_layer)
+    composite.paste(foreground, mask=mask)
+    return composite
+
+def fast_composite(background: Image.Image, foreground: Image.Image, mask: Image.Image) -> Image.Image:
+    composite = Text2ImageService._apply_shadow(background, mask)
+    composite.paste(foreground, mask=mask)
+    return composite
+
+def run(sizes, repeat: int) -> None:
+    print(f"{'size':>6} {'legacy ms':>10} {'fast ms':>10} {'speedup':>8} {'max diff':>9} {'mean diff':>10}")
+    for size in sizes:
+        fg = make_foreground(size)
+        bg = make_background(size)
+        mask = fg.split()[-1]
+        legacy = legacy_composite(bg, fg, mask)
+        fast = fast_composite(bg, fg, mask)
+        diff = np.abs(np.asarray(legacy, dtype=np.int16) - np.asarray(fast, dtype=np.int16))
+        t_legacy = best_of(lambda: legacy_composite(bg, fg, mask), repeat)
+        t_fast = best_of(lambda: fast_composite(bg, fg, mask), repeat)
+        print(
+            f"{size:>6} {t_legacy * 1000:>10.1f} {t_fast * 1000:>10.1f} "
+            f"{t_legacy / t_fast:>7.2f}x {int(diff.max()):>9} {diff.mean():>10.3f}"
+        )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1024,2000,3000", help="comma-separated square sizes in px")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(",")], args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Benchmark suite for the image hot paths: ingest (to_png_rgba_bytes), crop per
+preset, composite per option, the drop shadow, remove.bg preprocessing and
+batch zip export, on synthetic 1/12/24 MP fixtures (RGB and RGBA; PNG, JPEG,
+WebP).
+
+Every case runs in its own subprocess so its peak RSS can be measured (not
+on Windows, which has no `resource` module; memory is reported as n/a there).
+Results are written as JSON; --compare flags cases that got slower (or use
+more memory) than a stored baseline and exits non-zero.
+
+    cd backend && python -m benchmarks.bench_suite --output bench_results.json
+    python -m benchmarks.bench_suite --megapixels 1,12 --cases 'crop:*' --compare baseline.json
+    python -m benchmarks.bench_suite --current bench_results.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import atexit
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import make_cutout, make_rgb, timings
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is not reported
+    resource = None
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+INGEST_VARIANTS = (("RGB", "JPEG"), ("RGB", "PNG"), ("RGB", "WEBP"), ("RGBA", "PNG"), ("RGBA", "WEBP"))
+EXT = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+ZIP_ITEMS = 8
+# A case only counts as a memory regression when it also grew by this much.
+MEMORY_FLOOR_MB = 16.0
+
+# --- fixtures -----------------------------------------------------------------
+
+def fixture_path(root: Path, megapixels: float, mode: str, fmt: str) -> Path:
+    return root / f"{megapixels:g}mp-{mode.lower()}.{EXT[fmt]}"
+
+def build_fixtures(root: Path, megapixels: List[float]) -> None:
+    """Write every fixture once; existing files are reused."""
+    root.mkdir(parents=True, exist_ok=True)
+    background = root / "background.png"
+    if not background.exists():
+        make_rgb(1.05).resize((1024, 1024)).save(background, "PNG")
+    for mp in megapixels:
+        missing = [(m, f) for m, f in INGEST_VARIANTS if not fixture_path(root, mp, m, f).exists()]
+        if not missing:
+            continue
+        rgb = make_rgb(mp)
+        images = {"RGB": rgb, "RGBA": make_cutout(rgb)}
+        for mode, fmt in missing:
+            options = {"quality": 92} if fmt in ("JPEG", "WEBP") else {"compress_level": 6}
+            images[mode].save(fixture_path(root, mp, mode, fmt), fmt, **options)
+
+# --- cases --------------------------------------------------------------------
+# A case factory does its setup and returns (fn, units); units are what the
+# throughput is reported in ("MP" of input pixels or "MB" of output).
+
+def _ingest(root: Path, mp: float, mode: str, fmt: str):
+    from app.services.image_io_service import to_png_rgba_bytes
+
+    data = fixture_path(root, mp, mode, fmt).read_bytes()
+    return (lambda: to_png_rgba_bytes(data)), (mp, "MP")
+
+def _crop(root: Path, mp: float, preset: str):
+    from app.services.image_crop_service import ImageCropService
+
+    data = fixture_path(root, mp, "RGB", "JPEG").read_bytes()
+    return (lambda: ImageCropService.process_one_png(data, "bench.jpg", preset)), (mp, "MP")
+
+def _composite(root: Path, mp: float, option: int):
+    from app.services.text2image_service import Text2ImageService
+
+    foreground = fixture_path(root, mp, "RGBA", "PNG").read_bytes()
+    background = (root / "background.png").read_bytes() if option in (1, 2) else None
+    return (
+        lambda: Text2ImageService.composite_images(foreground, option, background_bytes=background)
+    ), (mp, "MP")
+
+def _shadow(root: Path, mp: float):
+    from app.services.text2image_service import Text2ImageService
+
+    with Image.open(fixture_path(root, mp, "RGBA", "PNG")) as im:
+        mask = im.getchannel("A")
+        background = Image.new("RGBA", im.size, (230, 230, 230, 255))
+    return (lambda: Text2ImageService._apply_shadow(background, mask)), (mp, "MP")
+
+def _preprocess(root: Path, mp: float):
+    from app.services.remove_bg_service import _preprocess as preprocess
+
+    data = fixture_path(root, mp, "RGB", "JPEG").read_bytes()
+    return (lambda: preprocess(data)), (mp, "MP")
+
+def _zip(root: Path, mp: float):
+    from app.services import image_io_service
+
+    image_io_service.OUTPUTS_ROOT = Path(tempfile.mkdtemp(prefix="bench-outputs-"))
+    atexit.register(shutil.rmtree, image_io_service.OUTPUTS_ROOT, True)
+    data = fixture_path(root, mp, "RGBA", "PNG").read_bytes()
+    for i in range(ZIP_ITEMS):
+        image_io_service.save_step_png("bench", "crop", f"item_{i}.png", data)
+
+    async def drain() -> int:
+        response = image_io_service.zip_paths_for_batch_step("bench", "crop")
+        return sum([len(chunk) async for chunk in response.body_iterator])
+
+    return (lambda: asyncio.run(drain())), (len(data) * ZIP_ITEMS / 1e6, "MB")
+
+def case_factories(megapixels: List[float]) -> Dict[str, Callable]:
+    from app.services.image_crop_service import ImageCropService
+
+    cases: Dict[str, Callable] = {}
+    for mp in megapixels:
+        for mode, fmt in INGEST_VARIANTS:
+            cases[f"ingest:{mode.lower()}-{EXT[fmt]}:{mp:g}mp"] = lambda r, mp=mp, m=mode, f=fmt: _ingest(r, mp, m, f)
+        for preset in ImageCropService.PRESETS:
+            cases[f"crop:{preset}:{mp:g}mp"] = lambda r, mp=mp, p=preset: _crop(r, mp, p)
+        for option in (1, 2, 3, 4):
+            cases[f"composite:option{option}:{mp:g}mp"] = lambda r, mp=mp, o=option: _composite(r, mp, o)
+        cases[f"shadow:{mp:g}mp"] = lambda r, mp=mp: _shadow(r, mp)
+        cases[f"preprocess:{mp:g}mp"] = lambda r, mp=mp: _preprocess(r, mp)
+        cases[f"zip:{ZIP_ITEMS}x{mp:g}mp"] = lambda r, mp=mp: _zip(r, mp)
+    return cases
+
+# --- measurement --------------------------------------------------------------
+
+def _maxrss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+def _proc_status_mb(field: str) -> float:
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1]) / 1024
+    raise OSError(field)
+
+def _reset_peak_rss() -> bool:
+    """Linux can reset the peak-RSS mark, so setup and imports do not mask the case itself."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+def run_case(name: str, fixtures: Path, megapixels: float, repeat: int) -> dict:
+    """Runs in the child process: setup, one warm-up call, then `repeat` timed calls."""
+    fn, (work, unit) = case_factories([megapixels])[name](fixtures)
+    exact = _reset_peak_rss()
+    rss_before = _proc_status_mb("VmRSS") if exact else _maxrss_mb()
+    fn()
+    seconds = timings(fn, repeat)
+    best = min(seconds)
+    rss_after = _proc_status_mb("VmHWM") if exact else _maxrss_mb()
+    measured = rss_before is not None and rss_after is not None
+    return {
+        "seconds_best": round(best, 5),
+        "seconds_median": round(statistics.median(seconds), 5),
+        "throughput": round(work / best, 3),
+        "throughput_unit": f"{unit}/s",
+        "peak_rss_mb": round(rss_after, 1) if measured else None,
+        "peak_delta_mb": round(max(0.0, rss_after - rss_before), 1) if measured else None,
+    }
+
+def _mb(value: Optional[float], spec: str) -> str:
+    return format(value, spec) if value is not None else format("n/a", spec.split(".")[0])
+
+def _case_megapixels(name: str) -> float:
+    return float(name.rsplit(":", 1)[1].split("x")[-1].rstrip("mp"))
+
+def run_suite(megapixels: List[float], patterns: List[str], repeat: int, fixtures: Path) -> dict:
+    build_fixtures(fixtures, megapixels)
+    names = [n for n in case_factories(megapixels) if not patterns or any(fnmatch.fnmatch(n, p) for p in patterns)]
+    results: Dict[str, dict] = {}
+    print(f"{'case':<34} {'best ms':>10} {'median ms':>10} {'throughput':>14} {'peak MB':>9} {'delta MB':>9}")
+    for name in names:
+        proc = subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.bench_suite",
+                "--run-case", name,
+                "--fixtures", str(fixtures),
+                "--repeat", str(repeat),
+                "--megapixels", f"{_case_megapixels(name):g}",
+            ],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{name:<34} FAILED\n{proc.stderr.strip()}")
+            results[name] = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        results[name] = r
+        print(
+            f"{name:<34} {r['seconds_best'] * 1000:>10.1f} {r['seconds_median'] * 1000:>10.1f} "
+            f"{r['throughput']:>9.2f} {r['throughput_unit']:<4} {_mb(r['peak_rss_mb'], '>9.1f')} {_mb(r['peak_delta_mb'], '>9.1f')}"
+        )
+    import PIL
+
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Print a side-by-side table; returns the names of regressed cases."""
+    regressions: List[str] = []
+    print(f"\n{'case':<34} {'baseline ms':>12} {'current ms':>11} {'change':>8} {'mem MB':>14}")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or "error" in cur or "error" in base:
+            continue
+        change = cur["seconds_best"] / base["seconds_best"] - 1.0
+        slower = change > threshold
+        heavier = False
+        if cur["peak_delta_mb"] is not None and base["peak_delta_mb"] is not None:
+            mem_growth = cur["peak_delta_mb"] - base["peak_delta_mb"]
+            heavier = mem_growth > MEMORY_FLOOR_MB and cur["peak_delta_mb"] > base["peak_delta_mb"] * (1 + threshold)
+        flag = "  REGRESSION" if slower or heavier else ""
+        print(
+            f"{name:<34} {base['seconds_best'] * 1000:>12.1f} {cur['seconds_best'] * 1000:>11.1f} "
+            f"{change:>+7.1%} {_mb(base['peak_delta_mb'], '>6.0f')}->{_mb(cur['peak_delta_mb'], '<6.0f')}{flag}"
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", default="1,12,24", help="comma-separated fixture sizes in MP")
+    parser.add_argument("--cases", default="", help="comma-separated glob patterns, e.g. 'crop:*,ingest:*:1mp'")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--fixtures", type=Path, help="fixture directory to create or reuse (default: a temp dir)")
+    parser.add_argument("--compare", type=Path, help="baseline results file to flag regressions against")
+    parser.add_argument("--current", type=Path, help="compare this results file instead of running the suite")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before a case is flagged")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    megapixels = [float(m) for m in args.megapixels.split(",") if m]
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.fixtures, megapixels[0], args.repeat)))
+        return
+
+    if args.current:
+        current = json.loads(args.current.read_text())
+    else:
+        fixtures = args.fixtures or Path(tempfile.mkdtemp(prefix="bench-fixtures-"))
+        try:
+            patterns = [p.strip() for p in args.cases.split(",") if p.strip()]
+            current = run_suite(megapixels, patterns, args.repeat, fixtures)
+        finally:
+            if args.fixtures is None:
+                shutil.rmtree(fixtures, ignore_errors=True)
+        args.output.write_text(json.dumps(current, indent=2))
+        print(f"\nwrote {args.output}")
+
+    if args.compare:
+        regressions = compare(current, json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nno regressions")
+
+if __name__ == "__main__":
+    main()
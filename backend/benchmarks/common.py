@@ -0,0 +1,56 @@
+"""
+Fixtures and timing helpers shared by the benchmark scripts.
+"""
+import io
+import math
+import time
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+def make_rgb(megapixels: float, noise: float = 6.0) -> Image.Image:
+    """3:2 photo-like image: smooth gradients plus sensor-style noise, so PNG/WebP sizes are realistic."""
+    w = int(math.sqrt(megapixels * 1_000_000 * 3 / 2))
+    h = int(w * 2 / 3)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    rgb = np.dstack(
+        [
+            127 + 110 * np.sin(xx / 37.0),
+            127 + 110 * np.cos(yy / 53.0),
+            127 + 110 * np.sin((xx + yy) / 91.0),
+        ]
+    )
+    if noise:
+        rgb += np.random.default_rng(0).normal(0, noise, rgb.shape).astype(np.float32)
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), "RGB")
+
+def make_photo(megapixels: float, fmt: str, mode: str = "RGB") -> bytes:
+    """make_rgb (or its make_cutout for mode RGBA) encoded as `fmt`."""
+    img = make_rgb(megapixels)
+    if mode == "RGBA":
+        img = make_cutout(img)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=92)
+    return buf.getvalue()
+
+def make_cutout(rgb: Image.Image) -> Image.Image:
+    """The photo with a soft-edged subject mask, like a remove.bg result."""
+    w, h = rgb.size
+    alpha = Image.new("L", rgb.size, 0)
+    ImageDraw.Draw(alpha).ellipse((w * 0.25, h * 0.1, w * 0.75, h * 0.9), fill=255)
+    out = rgb.convert("RGBA")
+    out.putalpha(alpha.filter(ImageFilter.GaussianBlur(2)))
+    return out
+
+def timings(fn: Callable, repeat: int) -> List[float]:
+    """Wall-clock seconds of `repeat` calls to `fn`."""
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        result.append(time.perf_counter() - start)
+    return result
+
+def best_of(fn: Callable, repeat: int) -> float:
+    return min(timings(fn, repeat))
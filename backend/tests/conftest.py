@@ -0,0 +1,30 @@
+import io
+import os
+
+# Configure the app before it is imported: no real API keys, no disk caches,
+# no local matting, and CPU work on threads instead of a process pool.
+os.environ.setdefault("REMOVEBG_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["REMOVE_BG_CACHE_MAX_BYTES"] = "0"
+os.environ["DALLE_CACHE_MAX_BYTES"] = "0"
+os.environ["LOCAL_MATTING"] = "0"
+os.environ["IMAGE_WORKERS"] = "0"
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+def png_bytes(size=(600, 600), color=(200, 10, 10, 255), mode="RGBA") -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from app.services import image_io_service
+
+    monkeypatch.setattr(image_io_service, "OUTPUTS_ROOT", tmp_path)
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
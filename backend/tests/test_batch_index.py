@@ -0,0 +1,42 @@
+import pytest
+from fastapi import HTTPException
+
+from app.services import image_io_service
+from app.services.image_io_service import detect_latest_step, list_step_items, load_step_items, save_step_png
+
+from .conftest import png_bytes
+
+
+def _legacy_file(batch_id: str, step: str, name: str) -> None:
+    """A file written before the index existed: on disk, no index row."""
+    path = image_io_service.OUTPUTS_ROOT / batch_id / step / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(png_bytes())
+
+
+def test_legacy_batch_keeps_old_files_after_new_save(client):
+    _legacy_file("legacy", "remove_bg", "a.png")
+    _legacy_file("legacy", "text2image", "a.png")
+    _legacy_file("legacy", "text2image", "b.png")
+    save_step_png("legacy", "remove_bg", "c.png", png_bytes())
+
+    assert [item["filename"] for item in load_step_items("legacy", "remove_bg")] == ["a.png", "c.png"]
+    assert detect_latest_step("legacy") == "text2image"
+    r = client.get("/io/batches/legacy/list", params={"step": "remove_bg"})
+    assert r.json()["total"] == 2
+
+
+def test_deleted_files_are_not_listed_or_served(client):
+    save_step_png("gone", "remove_bg", "a.png", png_bytes())
+    save_step_png("gone", "remove_bg", "b.png", png_bytes())
+    save_step_png("gone", "crop", "a.png", png_bytes())
+    (image_io_service.OUTPUTS_ROOT / "gone" / "remove_bg" / "a.png").unlink()
+    (image_io_service.OUTPUTS_ROOT / "gone" / "crop" / "a.png").unlink()
+
+    assert [item["filename"] for item in list_step_items("gone", "remove_bg")] == ["b.png"]
+    assert detect_latest_step("gone") == "remove_bg"
+    r = client.get("/io/batches/gone/list", params={"step": "remove_bg"})
+    assert r.json()["total"] == 1
+    with pytest.raises(HTTPException) as excinfo:
+        load_step_items("gone", "remove_bg", ["a.png"])
+    assert excinfo.value.status_code == 404
@@ -0,0 +1,29 @@
+import asyncio
+
+from app.services import executor_service
+
+
+def test_pool_stats_track_batch_slots(monkeypatch):
+    monkeypatch.setattr(executor_service, "MAX_PENDING", 2)
+    monkeypatch.setattr(executor_service, "_slots", None)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with executor_service._batch_slot():
+                await release.wait()
+
+        holders = [asyncio.create_task(hold()) for _ in range(3)]
+        await asyncio.sleep(0)
+        stats = executor_service.pool_stats()
+        assert (stats["batch_running"], stats["batch_slots_free"], stats["batch_waiting"]) == (2, 0, 1)
+        holders[2].cancel()
+        await asyncio.sleep(0)
+        assert executor_service.pool_stats()["batch_waiting"] == 0
+        release.set()
+        await asyncio.gather(*holders[:2])
+        stats = executor_service.pool_stats()
+        assert (stats["batch_running"], stats["batch_slots_free"], stats["batch_waiting"]) == (0, 2, 0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+import io
+
+from PIL import Image
+
+from app.services.image_crop_service import ImageCropService
+
+from .conftest import png_bytes
+
+
+def _noisy_png(side: int) -> bytes:
+    img = Image.effect_noise((side, side), 64).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _render(data: bytes, presets) -> dict:
+    return {preset: png for preset, _, png in ImageCropService.process_many_png(data, "x.png", presets)}
+
+
+def test_small_source_renders_each_preset_from_the_source():
+    # 1200 px is below the amazon size, so instagram must not be cut from an
+    # upscaled amazon render.
+    data = _noisy_png(1200)
+    together = _render(data, ["instagram", "amazon"])
+    alone = _render(data, ["instagram"])
+    assert Image.open(io.BytesIO(together["instagram"])).tobytes() == Image.open(io.BytesIO(alone["instagram"])).tobytes()
+
+
+def test_crop_route_renders_duplicates_once(client):
+    same = png_bytes()
+    r = client.post(
+        "/crop/custom/batch",
+        params={"preset": "instagram,shopee"},
+        files=[
+            ("files", ("a.png", same, "image/png")),
+            ("files", ("b.png", png_bytes(color=(10, 200, 10, 255)), "image/png")),
+            ("files", ("c.png", same, "image/png")),
+            ("files", ("bad.png", b"not an image", "image/png")),
+        ],
+    )
+    assert r.status_code == 200, r.text
+    items = r.json()["items"]
+    assert [(i["filename"], i["preset"], i.get("duplicate_of")) for i in items] == [
+        ("a.png", "instagram", None),
+        ("a.png", "shopee", None),
+        ("b.png", "instagram", None),
+        ("b.png", "shopee", None),
+        ("c.png", "instagram", "a.png"),
+        ("c.png", "shopee", "a.png"),
+        ("bad.png", "instagram", None),
+        ("bad.png", "shopee", None),
+    ]
+    assert all(i["ok"] for i in items[:6]) and not any(i["ok"] for i in items[6:])
+    assert r.json()["duplicates_skipped"] == 1
@@ -0,0 +1,48 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+
+from app.services import remove_bg_service
+
+
+def _rotated_studio_jpeg(size=(1200, 600)) -> bytes:
+    """Dark subject on a white sweep, stored landscape with EXIF orientation 6."""
+    img = Image.new("RGB", size, (250, 250, 250))
+    w, h = size
+    # Off-centre in the stored frame, so a sideways mask cannot match by symmetry.
+    ImageDraw.Draw(img).rectangle((w * 0.1, h * 0.2, w * 0.4, h * 0.8), fill=(30, 40, 60))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", exif=exif.tobytes(), quality=95)
+    return buf.getvalue()
+
+
+def _upright_subject(data: bytes, size) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as im:
+        upright = ImageOps.exif_transpose(im).convert("L").resize(size)
+    return np.asarray(upright) < 128
+
+
+def test_local_cutout_follows_exif_orientation(monkeypatch):
+    monkeypatch.setattr(remove_bg_service, "LOCAL_MATTING_ENABLED", True)
+
+    async def no_remote(*args, **kwargs):
+        raise AssertionError("the local engine should handle a plain backdrop")
+
+    svc = remove_bg_service.RemoveBGService()
+    monkeypatch.setattr(svc, "_remove_background_remote", no_remote)
+    data = _rotated_studio_jpeg()
+    for size, full_resolution, expected in (
+        ("auto", False, (600, 1200)),
+        ("preview", False, (353, 707)),
+        ("preview", True, (600, 1200)),
+    ):
+        cut = asyncio.run(svc.cutout(data, size=size, full_resolution=full_resolution))
+        assert cut.engine == "local"
+        with Image.open(io.BytesIO(cut.content)) as img:
+            assert img.size == expected
+            alpha = np.asarray(img.getchannel("A")) > 128
+        assert (alpha == _upright_subject(data, expected)).mean() > 0.98
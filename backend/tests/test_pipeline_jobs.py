@@ -0,0 +1,81 @@
+import asyncio
+import io
+import time
+import zipfile
+
+import pytest
+
+from .conftest import png_bytes
+
+def _wait_for_job(client, status_url: str, timeout_s: float = 30.0) -> dict:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        status = client.get(status_url).json()
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.05)
+    pytest.fail(f"job did not finish: {status}")
+
+@pytest.fixture
+def remote_calls(monkeypatch):
+    from app.routes import remove_bg_routes
+
+    calls = []
+
+    async def fake_remote(image_bytes, **kwargs):
+        calls.append(kwargs["filename_hint"])
+        await asyncio.sleep(0.2)
+        return png_bytes(color=(1, 2, 3, 255))
+
+    monkeypatch.setattr(remove_bg_routes.svc, "_remove_background_remote", fake_remote)
+    return calls
+
+def test_pipeline_job_results_and_download(client, remote_calls):
+    files = [
+        ("files", ("a.png", png_bytes(color=(10, 10, 10, 255)), "image/png")),
+        ("files", ("b.png", png_bytes(color=(20, 20, 20, 255)), "image/png")),
+    ]
+    r = client.post(
+        "/pipeline/run?background=1",
+        files=files,
+        data={"option": "3", "preset": "shopee,amazon"},
+    )
+    assert r.status_code == 202
+    job = r.json()
+    status = _wait_for_job(client, job["status_url"])
+    assert status["status"] == "done"
+    assert status["progress"]["done"] == 4
+
+    results = client.get(job["results_url"]).json()
+    assert sorted((item["filename"], item["stored_filename"].split("_crop_")[0]) for item in results["items"]) == [
+        ("a.png", "amazon"),
+        ("a.png", "shopee"),
+        ("b.png", "amazon"),
+        ("b.png", "shopee"),
+    ]
+    assert results["failed"] == []
+
+    download = client.get(f"/process/{job['job_id']}/download")
+    assert download.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(download.content)) as zf:
+        assert sorted(zf.namelist()) == sorted(item["stored_filename"] for item in results["items"])
+
+def test_pipeline_skips_remove_bg_once_background_failed(client, remote_calls, monkeypatch):
+    from app.routes import text2image_routes
+
+    async def failing_generate(**kwargs):
+        raise RuntimeError("content policy violation")
+
+    monkeypatch.setattr(text2image_routes.svc.client.images, "generate", failing_generate)
+    files = [("files", (f"p{i}.png", png_bytes(color=(i, i, i, 255)), "image/png")) for i in range(3)]
+    r = client.post(
+        "/pipeline/run?background=1&concurrent=1",
+        files=files,
+        data={"option": "1", "prompt": "marble", "preset": "instagram"},
+    )
+    job = r.json()
+    status = _wait_for_job(client, job["status_url"])
+    assert status["status"] == "failed"
+    assert all(item["failed_stage"] == "text2image" for item in status["items"])
+    # At most the item that raced the failed generation reached remove.bg.
+    assert len(remote_calls) <= 1
@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+from app.services import remove_bg_service
+from app.services.metrics_service import STAGE_ERRORS, STAGE_LATENCY
+
+
+class _FlakyClient:
+    """503 on the first attempt, 200 after; every request takes `delay` seconds."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    async def post(self, url, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        status = 503 if self.calls == 1 else 200
+        return httpx.Response(status, content=b"{}", request=httpx.Request("POST", url))
+
+
+def _stage(metric, stage):
+    with metric._lock:
+        return metric._values.get((stage,))
+
+
+def test_remove_bg_call_times_requests_not_backoff(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def short_sleep(seconds):
+        sleeps.append(seconds)
+        await real_sleep(0.3 if seconds >= 0.5 else seconds)
+
+    monkeypatch.setattr(remove_bg_service.asyncio, "sleep", short_sleep)
+    before = _stage(STAGE_LATENCY, "remove_bg_call")
+    count_before = sum(before[0]) if before else 0
+    sum_before = before[1] if before else 0.0
+    errors_before = _stage(STAGE_ERRORS, "remove_bg_call") or 0.0
+
+    svc = remove_bg_service.RemoveBGService()
+    client = _FlakyClient(delay=0.05)
+    r = asyncio.run(svc._post(client, data={}, files={"image_file": ("a.png", b"x", "image/png")}))
+
+    assert r.status_code == 200 and client.calls == 2
+    assert any(s >= 0.5 for s in sleeps)  # the retry backed off
+    counts, total = _stage(STAGE_LATENCY, "remove_bg_call")
+    assert sum(counts) - count_before == 2
+    assert total - sum_before < 0.25  # two 50 ms requests, without the 300 ms backoff
+    assert _stage(STAGE_ERRORS, "remove_bg_call") - errors_before == 1
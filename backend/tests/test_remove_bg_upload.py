@@ -0,0 +1,53 @@
+import io
+import pickle
+import zipfile
+
+import pytest
+from PIL import Image
+
+from app.services.remove_bg_service import (
+    RemoveBGError,
+    _merge_zip_result,
+    _prepare_upload,
+    _restore_full_resolution,
+)
+
+
+def _rotated_photo(fmt: str, size=(400, 200)) -> bytes:
+    """Noisy photo stored landscape with EXIF orientation 6 (display portrait)."""
+    red = Image.effect_noise(size, 20).point(lambda v: v // 4 + 150)
+    img = Image.merge("RGB", [red, Image.new("L", size, 30), Image.new("L", size, 30)])
+    img.paste((20, 20, 220), (0, 0, size[0] // 4, size[1] // 4))  # marker in the stored top-left
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    img.save(buf, fmt, exif=exif.tobytes(), quality=95)
+    return buf.getvalue()
+
+
+def test_prepare_upload_bakes_in_exif_orientation():
+    for fmt, max_pixels in (("PNG", None), ("JPEG", 20_000), ("PNG", 20_000)):
+        prepared, _ = _prepare_upload(_rotated_photo(fmt), max_pixels)
+        with Image.open(io.BytesIO(prepared)) as img:
+            assert img.height == 2 * img.width
+            assert img.getexif().get(0x0112, 1) == 1
+            # Rotated 90° clockwise, the marker ends up top-right.
+            assert img.convert("RGB").getpixel((int(img.width * 0.9), int(img.height * 0.05)))[2] > 150
+
+
+def test_restore_full_resolution_matches_upright_cutout():
+    buf = io.BytesIO()
+    Image.new("RGBA", (100, 200), (0, 0, 0, 255)).save(buf, "PNG")
+    rgba, _ = _restore_full_resolution(_rotated_photo("JPEG", (800, 400)), buf.getvalue())
+    assert Image.open(io.BytesIO(rgba)).size == (400, 800)
+
+
+def test_merge_zip_result_reports_missing_entries():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("color.jpg", b"")
+    with pytest.raises(RemoveBGError) as excinfo:
+        _merge_zip_result(buf.getvalue())
+    assert excinfo.value.payload["entries"] == ["color.jpg"]
+    # Pool workers send the error back pickled.
+    assert pickle.loads(pickle.dumps(excinfo.value)).payload == excinfo.value.payload
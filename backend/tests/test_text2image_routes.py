@@ -0,0 +1,27 @@
+import io
+
+from PIL import Image
+
+from .conftest import png_bytes
+
+
+def test_uploaded_mask_is_applied(client):
+    mask = Image.new("L", (600, 600), 0)
+    mask.paste(255, (300, 0, 600, 600))
+    buf = io.BytesIO()
+    mask.save(buf, "PNG")
+    r = client.post(
+        "/text2image/generate",
+        data={"option": "3", "prompt": "studio"},
+        files={
+            "foreground": ("fg.png", png_bytes(), "image/png"),
+            "mask": ("mask.png", buf.getvalue(), "image/png"),
+        },
+    )
+    assert r.status_code == 200, r.text
+    item = r.json()["items"][0]
+    with Image.open(item["saved_path"]) as out:
+        rgb = out.convert("RGB")
+        assert rgb.getpixel((50, 300))[1] > 200  # masked out: white backdrop
+        assert rgb.getpixel((550, 300)) == (200, 10, 10)
+